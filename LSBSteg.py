@@ -2,8 +2,11 @@
 # coding=utf-8
 """
 Usage:
-  LSBSteg.py encode -i <input> -o <output> -f <file>
-  LSBSteg.py decode -i <input> -o <output>
+  LSBSteg.py encode -i <input> -o <output> -f <file> [--compress=<codec>] [--level=<n>] [--workers=<n>] [--png-level=<n>] [--png-strategy=<s>]
+  LSBSteg.py encode -i <input> -f <file> --mmap [--compress=<codec>] [--level=<n>] [--workers=<n>]
+  LSBSteg.py decode -i <input> -o <output> [--mmap] [--workers=<n>]
+  LSBSteg.py info -i <input> [-f <file>] [--mmap]
+  LSBSteg.py batch -m <manifest> [--compress=<codec>] [--level=<n>] [--processes=<n>] [--inflight=<n>] [--png-level=<n>] [--png-strategy=<s>]
 
 Options:
   -h, --help                Show this help
@@ -11,18 +14,112 @@ Options:
   -f,--file=<file>          File to hide
   -i,--in=<input>           Input image (carrier)
   -o,--out=<output>         Output image (or extracted file)
+  --compress=<codec>        Compress the file with zlib or lzma before hiding it, decoding detects it
+  --level=<n>               zlib level (0-9) or lzma preset (0-9) of --compress (default: the codec's)
+  --mmap                    Memory-map an uncompressed BMP/PPM/NPY carrier, encode writes it in place
+  --workers=<n>             Threads embedding/extracting row stripes in parallel [default: 1]
+  -m,--manifest=<manifest>  CSV or JSONL jobs with input, payload and output (no payload means decode)
+  --processes=<n>           Worker processes for batch jobs (default: one per CPU)
+  --inflight=<n>            Batch jobs queued at once (default: twice the processes)
+  --png-level=<n>           PNG zlib compression level, 0 (fastest) to 9 (smallest) (default: OpenCV's)
+  --png-strategy=<s>        PNG zlib strategy: default, filtered, huffman, rle or fixed
 """
 
+import csv
 import cv2
 import docopt
+import json
+import lzma
 import numpy as np
 import os
+import re
+import struct
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from queue import Queue
+from threading import Thread
+
+CHUNK_SIZE = 1 << 20 #Payload bytes unpacked per vectorized pass (8 slots each)
+
+IMAGE_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64) #Pixel types encode_image can hide
+
+#Payloads start with a versioned header, checked in one read of HEADER_BITS slots before any payload byte.
+#Images from before it hold a bare 64 bit length (binary) or 16 bit length (text); a binary length
+#starting with the magic would be exabytes long, so for binary the two can't be confused.
+HEADER_MAGIC = b"LSB"
+HEADER_VERSION = 2
+HEADER = struct.Struct(">3sBBBBQI") #Magic, version, payload type, bit planes used, flags, stored length, CRC32 of the stored bytes
+HEADER_BITS = HEADER.size * 8
+PAYLOAD_TYPES = ("binary", "text", "image")
+COMPRESSIONS = {"zlib": 1, "lzma": 2} #Compression codes, in the low bits of the flags
+FLAG_COMPRESSION = 0x03
+LEGACY_BINARY = {"version": 0, "type": "binary", "planes": None, "compression": 0, "crc": None, "header_bits": 64}
+
+class SteganographyException(Exception):
+    pass
+
+def compressor(compression, level=None): #Streaming compressor object, with compress() and flush()
+    if compression == "zlib":
+        return zlib.compressobj(-1 if level is None else level)
+    if compression == "lzma":
+        return lzma.LZMACompressor(preset=level)
+    raise SteganographyException(f"Unknown compression '{compression}', use one of {', '.join(COMPRESSIONS)}")
+
+def decompressor(code): #Streaming decompressor for a header compression code, with decompress() and eof
+    if code == COMPRESSIONS["zlib"]:
+        return zlib.decompressobj()
+    if code == COMPRESSIONS["lzma"]:
+        return lzma.LZMADecompressor()
+    raise SteganographyException(f"Unknown compression code {code} in the payload header")
+
+def inflate(inflater, data, limit=CHUNK_SIZE): #Yield what data decompresses to, at most limit bytes at a time
+    #A few KB of payload can inflate to gigabytes, so output is never produced in one call
+    while True:
+        try:
+            out = inflater.decompress(data, limit)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise SteganographyException(f"Corrupt compressed payload ({e})") from e
+        if out:
+            yield out
+        if inflater.eof:
+            return
+        data = getattr(inflater, "unconsumed_tail", b"") #zlib hands back the input it didn't use, lzma keeps it
+        if not data and len(out) < limit and getattr(inflater, "needs_input", True):
+            return
+
+def parse_header(head, nbslots=None, start=0):
+    #Fields of the versioned header at the start of head, None when it doesn't start with the magic (legacy layout).
+    #Raises SteganographyException when the header can't be right; with the carrier's nbslots (and the slot the
+    #header starts at) the bit planes it announces must also match its length.
+    if head[:3] != HEADER_MAGIC:
+        return None
+    version = head[3] if len(head) > 3 else None
+    if version == HEADER_VERSION and len(head) >= HEADER.size:
+        _, _, kind, planes, flags, length, crc = HEADER.unpack_from(head)
+        if kind >= len(PAYLOAD_TYPES) or flags & ~FLAG_COMPRESSION:
+            raise SteganographyException("Corrupt payload header (unknown type or flags)")
+        header = {"version": version, "type": PAYLOAD_TYPES[kind], "planes": planes, "compression": flags & FLAG_COMPRESSION,
+                  "length": length, "crc": crc, "header_bits": HEADER_BITS}
+        if nbslots and planes != -(-(start + HEADER_BITS + length * 8) // nbslots):
+            raise SteganographyException("Corrupt payload header (length and bit planes disagree)")
+    else:
+        raise SteganographyException(f"Unsupported payload header version {version}" if len(head) > 3 else "Payload header cut short")
+    if header["compression"]:
+        decompressor(header["compression"]) #Unknown codes fail here, before any payload is read
+    return header
+
+def check_crc(header, crc): #Versioned headers carry the CRC32 of the stored payload, legacy ones nothing to check
+    if header["crc"] is not None and crc != header["crc"]:
+        raise SteganographyException("Payload CRC mismatch, the image was modified or holds no payload")
+
 
 class LSBSteg():
     def __init__(self, im):
-        self.image = im
+        self.image = im #Any strided uint8 array works, e.g. a np.memmap view of the file's pixels
         self.height, self.width, self.nbchannels = im.shape
         self.size = self.width * self.height
+        self.nbslots = self.size * self.nbchannels #Slots available in one bit plane
         
         self.maskONEValues = [1,2,4,8,16,32,64,128]
         #Mask used to put one ex:1->00000001, 2->00000010 .. associated with OR bitwise
@@ -37,15 +134,114 @@ class LSBSteg():
         self.curchan = 0   # Current channel position
 
     def put_binary_value(self, bits): #Put the bits in the image
-        for c in bits:
-            val = list(self.image[self.curheight,self.curwidth]) #Get the pixel value as a list
-            if int(c) == 1:
-                val[self.curchan] = int(val[self.curchan]) | self.maskONE #OR with maskONE
-            else:
-                val[self.curchan] = int(val[self.curchan]) & self.maskZERO #AND with maskZERO
-                
-            self.image[self.curheight,self.curwidth] = tuple(val)
-            self.next_slot() #Move "cursor" to the next space
+        self.put_bits(np.frombuffer(bits.encode("ascii"), np.uint8) - ord("0"))
+
+    def put_bits(self, bits): #Put an array of 0/1 values in the image, one bit plane at a time
+        bits = np.asarray(bits, dtype=np.uint8)
+        start = self._tell()
+        end = start + bits.size
+        self._check_room(end)
+        self._put_range(bits, start, end)
+        self._seek(end)
+
+    def put_bytes(self, data, workers=1): #Put raw bytes in the image, in stripes of at most CHUNK_SIZE bytes
+        data = np.frombuffer(data, np.uint8)
+        start = self._tell()
+        end = start + data.size * 8
+        self._check_room(end)
+        def put(a, b): #Unpack only the bytes covering slots a..b
+            i, j = a - start, b - start
+            self._put_range(np.unpackbits(data[i // 8:-(-j // 8)])[i % 8:i % 8 + j - i], a, b)
+        #Stripes start on a row and never cross a plane, so no two workers touch the same byte
+        self._run(put, self._stripes(start, end, workers, self.width * self.nbchannels, planes=True), workers)
+        self._seek(end)
+
+    def _put_range(self, bits, start, end):
+        for plane, view, off in self._segments(start, end, write=True):
+            view &= 255 ^ (1 << plane) #AND with maskZERO
+            view |= bits[off:off + view.size].reshape(view.shape) << plane #OR with the bits moved to maskONE
+
+    def _read_range(self, start, end):
+        bits = np.empty(end - start, np.uint8)
+        for plane, view, off in self._segments(start, end):
+            out = bits[off:off + view.size].reshape(view.shape)
+            np.right_shift(view, plane, out=out)
+            out &= 1
+        return bits
+
+    def _stripes(self, start, end, workers, align, origin=0, planes=False): #Split slots start..end in groups of (a, b) stripes
+        size = min(CHUNK_SIZE * 8, -(-(end - start) // workers)) #Enough stripes to feed every worker
+        size = max(1, -(-size // align)) * align
+        groups = []
+        pos = start
+        while pos < end:
+            stop = min(end, (pos // self.nbslots + 1) * self.nbslots) if planes else end
+            group = []
+            while pos < stop:
+                nxt = min(stop, origin + (pos - origin + size) // align * align) #Cut on a multiple of align
+                group.append((pos, nxt))
+                pos = nxt
+            groups.append(group)
+        return groups
+
+    def _run(self, fn, groups, workers): #Call fn(a, b) for every stripe, groups one after the other
+        if workers <= 1:
+            for group in groups:
+                for a, b in group:
+                    fn(a, b)
+            return
+        with ThreadPoolExecutor(workers) as pool: #NumPy releases the GIL in the bitwise kernels
+            for group in groups:
+                list(pool.map(fn, *zip(*group)))
+
+    def _segments(self, start, end, write=False): #Split slots start..end into (plane, carrier view, bit offset) in cursor order
+        rowlen = self.width * self.nbchannels
+        pos = start
+        while pos < end:
+            plane, idx = divmod(pos, self.nbslots)
+            row, col = divmod(idx, rowlen)
+            n = min(end - pos, self.nbslots - idx) #Stop at the end of the current plane
+            if col == 0 and n >= rowlen: #Run of full rows, kept 3D so any carrier strides work
+                nrows = n // rowlen
+                n = nrows * rowlen
+                yield plane, self.image[row:row + nrows], pos - start
+            else: #Part of a single row
+                n = min(n, rowlen - col)
+                line = self.image[row].reshape(-1) #A copy if the row isn't contiguous
+                yield plane, line[col:col + n], pos - start
+                if write and not np.may_share_memory(line, self.image):
+                    self.image[row] = line.reshape(self.width, self.nbchannels)
+            pos += n
+
+    def _tell(self): #Linear index of the cursor: plane, then height, width and channel
+        plane = self.maskONE.bit_length() - 1
+        return plane * self.nbslots + (self.curheight * self.width + self.curwidth) * self.nbchannels + self.curchan
+
+    def _seek(self, offset): #Move the cursor (and masks) to the given linear slot index
+        self.curheight, self.curwidth, self.curchan, self.maskONE = self.slot(offset)
+        self.maskONEValues = [m for m in (1, 2, 4, 8, 16, 32, 64, 128) if m > self.maskONE]
+        self.maskZERO = 255 ^ self.maskONE
+        self.maskZEROValues = [255 ^ m for m in self.maskONEValues]
+
+    def slot(self, offset): #(height, width, channel, maskONE) of a linear slot index, in O(1)
+        plane, idx = divmod(offset, self.nbslots)
+        if offset < 0 or plane > 7:
+            raise SteganographyException("No available slot remaining (image filled)")
+        pixel, chan = divmod(idx, self.nbchannels)
+        height, width = divmod(pixel, self.width)
+        return height, width, chan, 1 << plane
+
+    def payload_slot(self, bitoffset, header_bits=HEADER_BITS): #Slot holding bit bitoffset of an encode_binary payload (after its header, 64 bits on legacy images)
+        return self.slot(header_bits + bitoffset)
+
+    def peek_bytes(self, nbytes): #First nbytes hidden in plane 0, read in one fancy-indexing op without moving the cursor
+        h, rest = np.divmod(np.arange(nbytes * 8), self.width * self.nbchannels)
+        w, c = np.divmod(rest, self.nbchannels)
+        return np.packbits(self.image[h, w, c] & 1).tobytes()
+
+    def _check_room(self, end): #Same limit as next_slot: the last slot of the last plane can't be used
+        if end >= 8 * self.nbslots:
+            raise SteganographyException("No available slot remaining (image filled)")
         
     def next_slot(self):#Move to the next slot were information can be hidden
         if self.curchan == self.nbchannels-1: #Next Space is the following channel
@@ -79,9 +275,14 @@ class LSBSteg():
         return self.read_bits(8)
     
     def read_bits(self, nb): #Read the given number of bits
-        bits = ""
-        for i in range(nb):
-            bits += self.read_bit()
+        return (self.read_bit_array(nb) + ord("0")).tobytes().decode("ascii")
+
+    def read_bit_array(self, nb): #Read nb bits as an array of 0/1 values, one bit plane at a time
+        start = self._tell()
+        end = start + nb
+        self._check_room(end)
+        bits = self._read_range(start, end)
+        self._seek(end)
         return bits
 
     def byteValue(self, val):
@@ -95,16 +296,39 @@ class LSBSteg():
             binval = "0"+binval
         return binval
 
-    def encode_text(self, txt):
-        l = len(txt)
-        binl = self.binary_value(l, 16) #Length coded on 2 bytes so the text size can be up to 65536 bytes long
-        self.put_binary_value(binl) #Put text length
-        for char in txt: #And put all the chars
-            c = ord(char)
-            self.put_binary_value(self.byteValue(c))
-        return self.image
+    def plan(self, nbbytes, header_bits=HEADER_BITS): #What hiding nbbytes (after a header) from the cursor costs, without touching pixels
+        start = self._tell()
+        end = start + header_bits + nbbytes * 8
+        limit = 8 * self.nbslots - 1 #next_slot never lets the last slot be used
+        #Payload bytes that fit when filling planes 0..k-1, for k = 1..8
+        capacity = [max(0, (min(k * self.nbslots, limit) - start - header_bits) // 8) for k in range(1, 9)]
+        planes = min(8, -(-end // self.nbslots)) #Planes touched, counting from plane 0
+        #Each slot written flips its bit half of the time, by 2**plane
+        sqerr = sum(0.5 * 4 ** p * max(0, min(end, (p + 1) * self.nbslots) - max(start, p * self.nbslots)) for p in range(8))
+        mse = sqerr / self.nbslots
+        return {
+            "fits": end <= limit,
+            "slots": end - start,
+            "planes": planes,
+            "plane_slots": self.nbslots,
+            "capacity": capacity,
+            "mse": mse,
+            "psnr": 10 * np.log10(255 ** 2 / mse) if mse else float("inf"),
+        }
+
+    def _check_capacity(self, nbbytes, header_bits): #Fail in O(1), before any pixel is modified
+        if self._tell() + header_bits + nbbytes * 8 > 8 * self.nbslots - 1:
+            available = self.plan(0, header_bits)["capacity"][-1]
+            raise SteganographyException(f"Carrier image not big enough to hold all the datas to steganography ({nbbytes} bytes, {available} available)")
+
+    def encode_text(self, txt): #UTF-8, behind a text header
+        return self._encode_payload([txt.encode("utf-8")], "text")
        
     def decode_text(self):
+        header = self._read_header("text")
+        if header is not None:
+            return self._read_payload(header).decode("utf-8")
+        #Legacy layout: a 16 bit length then one byte per char
         ls = self.read_bits(16) #Read the text size in bytes
         l = int(ls,2)
         i = 0
@@ -115,57 +339,435 @@ class LSBSteg():
             unhideTxt += chr(int(tmp,2)) #Every chars concatenated to str
         return unhideTxt
 
-    def encode_image(self, imtohide):
-        w = imtohide.width
-        h = imtohide.height
-        if self.width*self.height*self.nbchannels < w*h*imtohide.channels:
-            raise SteganographyException("Carrier image not big enough to hold all the datas to steganography")
-        binw = self.binary_value(w, 16) #Width coded on to byte so width up to 65536
-        binh = self.binary_value(h, 16)
-        self.put_binary_value(binw) #Put width
-        self.put_binary_value(binh) #Put height
-        for h in range(imtohide.height): #Iterate the hole image to put every pixel values
-            for w in range(imtohide.width):
-                for chan in range(imtohide.channels):
-                    val = imtohide[h,w][chan]
-                    self.put_binary_value(self.byteValue(int(val)))
+    def encode_image(self, imtohide, workers=1):
+        if imtohide.ndim == 2: #Grayscale, stored as a single channel
+            imtohide = imtohide[:, :, np.newaxis]
+        h, w, chans = imtohide.shape
+        if imtohide.dtype.type not in IMAGE_DTYPES:
+            raise SteganographyException(f"Unsupported image type {imtohide.dtype}")
+        pixels = np.ascontiguousarray(imtohide, imtohide.dtype.newbyteorder("<")) #Little endian on every host
+        if w > 0xFFFF or h > 0xFFFF:
+            raise SteganographyException(f"Image too large to hide ({w}x{h}, 65535 pixels per side at most)")
+        #Width, height, channels and the dtype as an index in IMAGE_DTYPES, then every pixel value, height -> width -> channel
+        size = struct.pack(">HHBB", w, h, chans, IMAGE_DTYPES.index(imtohide.dtype.type))
+        return self._encode_payload([size, pixels.reshape(-1).view(np.uint8)], "image", workers=workers)
+
+    def decode_image(self, workers=1):
+        header = self._read_header("image")
+        if header is None:
+            raise SteganographyException("No hidden image found (no payload header)")
+        size = self.read_bytes(6)
+        width, height, chans, code = struct.unpack(">HHBB", size)
+        if code >= len(IMAGE_DTYPES):
+            raise SteganographyException("No hidden image found (unknown pixel type)")
+        dtype = np.dtype(IMAGE_DTYPES[code]).newbyteorder("<")
+        nbbytes = width * height * chans * dtype.itemsize
+        if header["length"] != 6 + nbbytes:
+            raise SteganographyException("Corrupt payload header (length doesn't match the image size)")
+        raw = self.read_bytes(nbbytes, workers)
+        check_crc(header, zlib.crc32(raw, zlib.crc32(size)))
+        unhideimg = np.frombuffer(raw, dtype).reshape(height, width, chans)
+        return unhideimg[:, :, 0] if chans == 1 else unhideimg
+
+    def encode_binary(self, data, workers=1, compression=None, level=None): #compression: None, "zlib" or "lzma"
+        code = 0
+        if compression is not None:
+            packer = compressor(compression, level)
+            data = packer.compress(data) + packer.flush()
+            code = COMPRESSIONS[compression]
+        return self._encode_payload([data], "binary", code, workers)
+
+    def _encode_payload(self, parts, kind, compression=0, workers=1): #Header, then the bytes of every part
+        nbbytes = sum(memoryview(part).nbytes for part in parts)
+        self._check_capacity(nbbytes, HEADER_BITS)
+        crc = 0
+        for part in parts:
+            crc = zlib.crc32(part, crc)
+        self._put_header(self._tell(), kind, compression, nbbytes, crc)
+        for part in parts:
+            self.put_bytes(part, workers)
         return self.image
 
-                    
-    def decode_image(self):
-        width = int(self.read_bits(16),2) #Read 16bits and convert it in int
-        height = int(self.read_bits(16),2)
-        unhideimg = np.zeros((height,width,3), np.uint8) #Create an image in which we will put all the pixels read
-        for h in range(height):
-            for w in range(width):
-                for chan in range(unhideimg.channels):
-                    val = list(unhideimg[h,w])
-                    val[chan] = int(self.read_byte(),2) #Read the value
-                    unhideimg[h,w] = tuple(val)
-        return unhideimg
-    
-    def encode_binary(self, data):
-        l = len(data)
-        if self.width*self.height*self.nbchannels < l+64:
-            raise SteganographyException("Carrier image not big enough to hold all the datas to steganography")
-        self.put_binary_value(self.binary_value(l, 64))
-        for byte in data:
-            byte = byte if isinstance(byte, int) else ord(byte) # Compat py2/py3
-            self.put_binary_value(self.byteValue(byte))
+    def _put_header(self, start, kind, compression, length, crc): #Header at slot start, the cursor is left after it
+        planes = -(-(start + HEADER_BITS + length * 8) // self.nbslots)
+        self._seek(start)
+        self.put_bytes(HEADER.pack(HEADER_MAGIC, HEADER_VERSION, PAYLOAD_TYPES.index(kind), planes, compression, length, crc))
+
+    def encode_stream(self, fileobj, length=None, workers=1, compression=None, level=None): #Like encode_binary, but reads the payload CHUNK_SIZE bytes at a time
+        #The stored size and CRC are only known at the end, so the payload goes first and the header is written last.
+        #With compression, running out of room is only found out once pixels have been modified.
+        if length is None: #Default to everything left in the file
+            pos = fileobj.tell()
+            length = fileobj.seek(0, os.SEEK_END) - pos
+            fileobj.seek(pos)
+        packer = compressor(compression, level) if compression is not None else None
+        self._check_capacity(0 if packer else length, HEADER_BITS)
+        start = self._tell()
+        self._seek(start + HEADER_BITS)
+        crc = 0
+        buf = bytearray(min(CHUNK_SIZE, length))
+        left = length
+        while left:
+            n = fileobj.readinto(memoryview(buf)[:min(CHUNK_SIZE, left)])
+            if not n:
+                raise SteganographyException(f"Stream ended {left} bytes before the announced length")
+            chunk = packer.compress(memoryview(buf)[:n]) if packer else memoryview(buf)[:n]
+            self._put_stored(chunk, workers)
+            crc = zlib.crc32(chunk, crc)
+            left -= n
+        if packer:
+            chunk = packer.flush()
+            self._put_stored(chunk, workers)
+            crc = zlib.crc32(chunk, crc)
+        end = self._tell()
+        self._put_header(start, "binary", COMPRESSIONS[compression] if packer else 0, (end - start - HEADER_BITS) // 8, crc)
+        self._seek(end)
         return self.image
 
-    def decode_binary(self):
-        l = int(self.read_bits(64), 2)
-        output = b""
-        for i in range(l):
-            output += chr(int(self.read_byte(), 2)).encode("utf-8")
+    def _put_stored(self, data, workers):
+        if self._tell() + len(data) * 8 > 8 * self.nbslots - 1:
+            raise SteganographyException("Carrier image not big enough to hold the compressed data")
+        self.put_bytes(data, workers)
+
+    def _read_header(self, kind): #Versioned header at the cursor, which is left on the payload; None (cursor unmoved) on a legacy layout
+        start = self._tell()
+        if start + HEADER_BITS > 8 * self.nbslots - 1:
+            return None #Too small for a header, only a legacy payload can fit
+        head = bytes(self.read_bytes(HEADER.size))
+        try:
+            header = parse_header(head, self.nbslots, start)
+        except SteganographyException:
+            if kind != "text": #No legacy binary payload starts with the magic, and images always have a header
+                raise
+            header = None #A legacy text whose first bytes look like the magic
+        if header is None:
+            self._seek(start)
+            return None
+        if header["type"] != kind:
+            raise SteganographyException(f"The image holds a {header['type']} payload, not {kind}")
+        self._seek(start + header["header_bits"])
+        return header
+
+    def _read_binary_header(self): #Header of a binary payload at the cursor, legacy images give their 64 bit length
+        header = self._read_header("binary")
+        if header is None:
+            header = dict(LEGACY_BINARY, length=int(self.read_bits(64), 2))
+        return header
+
+    def _read_payload(self, header, workers=1): #Stored payload after a header, checked and decompressed
+        data = self.read_bytes(header["length"], workers) #bytearray, filled in place without an extra bytes copy
+        check_crc(header, zlib.crc32(data))
+        if not header["compression"]:
+            return data
+        inflater = decompressor(header["compression"])
+        output = bytearray()
+        for piece in inflate(inflater, data):
+            output += piece
+        if not inflater.eof:
+            raise SteganographyException("Compressed payload is truncated")
+        return output
+
+    def read_bytes(self, nb, workers=1): #Read nb bytes into a preallocated buffer, in stripes of at most CHUNK_SIZE bytes
+        start = self._tell()
+        end = start + nb * 8
+        self._check_room(end) #Fail before allocating for a bogus length
+        output = bytearray(nb)
+        view = np.frombuffer(output, np.uint8)
+        def read(a, b): #Stripes are cut on byte boundaries of the payload
+            view[(a - start) // 8:(b - start) // 8] = np.packbits(self._read_range(a, b))
+        self._run(read, self._stripes(start, end, workers, 8, origin=start), workers)
+        self._seek(end)
         return output
 
+    def decode_binary(self, workers=1):
+        return self._read_payload(self._read_binary_header(), workers)
+
+    def decode_budgeted(self, budget_ms=None, max_bytes=None, chunk=1 << 16): #decode_binary checking a time budget between chunks
+        #Returns (data, complete): data is what was read when budget_ms ran out, empty when the length is over max_bytes.
+        #A compressed payload is inflated chunk by chunk, data is then what the chunks read so far decompress to;
+        #max_bytes and the budget apply to the inflated bytes too, checked at most every chunk bytes of output.
+        #Like decode_binary, raises SteganographyException on a CRC mismatch or a corrupt compressed stream.
+        deadline = None if budget_ms is None else time.perf_counter() + budget_ms / 1000
+        header = self._read_binary_header()
+        l = header["length"]
+        if max_bytes is not None and l > max_bytes:
+            return bytearray(), False
+        self._check_room(self._tell() + l * 8)
+        inflater = decompressor(header["compression"]) if header["compression"] else None
+        output = bytearray() if inflater else bytearray(l)
+        crc = 0
+        for start in range(0, l, chunk):
+            if deadline is not None and time.perf_counter() > deadline:
+                return output if inflater else output[:start], False
+            n = min(chunk, l - start)
+            data = self.read_bytes(n)
+            crc = zlib.crc32(data, crc)
+            if inflater:
+                for piece in inflate(inflater, data, chunk):
+                    output += piece
+                    if max_bytes is not None and len(output) > max_bytes:
+                        return bytearray(), False
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return output, False
+            else:
+                output[start:start + n] = data
+        check_crc(header, crc)
+        return output, inflater is None or inflater.eof
+
+    def read_range(self, offset, length, workers=1): #Read length bytes at byte offset of the payload, skipping what's before (and the CRC check)
+        self._seek(0)
+        header = self._read_binary_header()
+        l = header["length"]
+        if header["compression"]:
+            raise SteganographyException("A compressed payload can't be read by range, use decode_stream")
+        if offset < 0 or length < 0 or offset + length > l:
+            raise SteganographyException(f"Range {offset}+{length} outside of the {l} bytes payload")
+        self._seek(self._tell() + offset * 8)
+        return self.read_bytes(length, workers)
+
+    def decode_stream(self, fileobj, workers=1): #Like decode_binary, but writes the payload CHUNK_SIZE bytes at a time
+        #Returns the number of bytes written, a compressed payload is inflated as its chunks are read.
+        #The CRC can only be checked at the end, after everything was written.
+        header = self._read_binary_header()
+        l = header["length"]
+        self._check_room(self._tell() + l * 8)
+        inflater = decompressor(header["compression"]) if header["compression"] else None
+        left = l
+        written = crc = 0
+        while left:
+            n = min(CHUNK_SIZE, left)
+            data = self.read_bytes(n, workers)
+            crc = zlib.crc32(data, crc)
+            for piece in inflate(inflater, data) if inflater else (data,):
+                fileobj.write(piece)
+                written += len(piece)
+            left -= n
+        check_crc(header, crc)
+        if inflater and not inflater.eof:
+            raise SteganographyException("Compressed payload is truncated")
+        return written
+
+def check_header(img, planes=8): #Stored payload length if img may hold an encode_binary payload in its first planes, else None
+    steg = LSBSteg(img) #Only the header slots are read, noise frames are rejected in microseconds
+    if steg.nbslots < LEGACY_BINARY["header_bits"]:
+        return None
+    head = steg.peek_bytes(min(HEADER.size, steg.nbslots // 8))
+    try:
+        header = parse_header(head, steg.nbslots)
+    except SteganographyException:
+        return None
+    if header is None: #Legacy layout, a bare 64-bit length
+        header = dict(LEGACY_BINARY, length=int.from_bytes(head[:8], "big"))
+    elif header["type"] != "binary":
+        return None
+    l, header_bits = header["length"], header["header_bits"]
+    end = header_bits + l * 8
+    return l if l and end <= min(planes * steg.nbslots, 8 * steg.nbslots - 1) else None
+
+PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
+
+def write_png(path, img, level=None, strategy=None): #cv2.imwrite with a zlib level/strategy, PNG only so the output stays lossless
+    if os.path.splitext(path)[1].lower() != ".png":
+        raise SteganographyException(f"'{path}' is not a .png file, the hidden data would not survive")
+    if strategy is not None and strategy not in PNG_STRATEGIES:
+        raise SteganographyException(f"Unknown PNG strategy '{strategy}', use one of {', '.join(PNG_STRATEGIES)}")
+    params = []
+    if level is not None:
+        params += [cv2.IMWRITE_PNG_COMPRESSION, int(level)]
+    if strategy is not None:
+        params += [cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[strategy]]
+    if not cv2.imwrite(path, img, params):
+        raise SteganographyException(f"Could not write '{path}'")
+
+class PNGWriter():
+    #Writes PNGs on a background thread, so the caller can embed the next carrier while zlib runs
+    def __init__(self, level=None, strategy=None, maxsize=2):
+        self.level = level
+        self.strategy = strategy
+        self.queue = Queue(maxsize) #Bounds how many encoded carriers wait in memory
+        self.error = None
+        self.thread = Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                write_png(*item, self.level, self.strategy)
+            except Exception as e:
+                self.error = self.error or e #Raised by the next write() or close()
+
+    def write(self, path, img): #img must not be modified until close() returns
+        self._raise_error()
+        self.queue.put((path, img))
+
+    def close(self): #Wait for the pending writes
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def memmap_carrier(path, mode="r+"): #Map the pixels of an uncompressed carrier file, in the same layout as cv2.imread
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        im = np.load(path, mmap_mode=mode)
+        if im.dtype != np.uint8 or im.ndim not in (2, 3):
+            raise SteganographyException(f"'{path}' is not a uint8 image array")
+        return im if im.ndim == 3 else im[:, :, np.newaxis]
+    with open(path, "rb") as f:
+        head = f.read(512)
+    if head[:2] == b"BM":
+        offset, = np.frombuffer(head, "<u4", 1, 10)
+        width, height = np.frombuffer(head, "<i4", 2, 18)
+        bpp, = np.frombuffer(head, "<u2", 1, 28)
+        compression, = np.frombuffer(head, "<u4", 1, 30)
+        bgr_masks = compression == 3 and bpp == 32 and tuple(np.frombuffer(head, "<u4", 3, 54)) == (0xFF0000, 0xFF00, 0xFF)
+        if not (compression == 0 or bgr_masks) or bpp not in (24, 32):
+            raise SteganographyException("Only uncompressed 24/32 bit BMP carriers can be mapped")
+        nbchans = bpp // 8
+        stride = (width * bpp + 31) // 32 * 4 #Rows are padded to 4 bytes
+        rows = np.memmap(path, np.uint8, mode, int(offset), (abs(height), stride))
+        im = rows[:, :width * nbchans].reshape(abs(height), width, nbchans)[:, :, :3] #BGR, alpha dropped like cv2.imread
+        return im[::-1] if height > 0 else im #Positive height means bottom-up rows
+    m = re.match(rb"(P[56])(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)(?:\s+|#[^\n]*\n)+(\d+)\s", head)
+    if m:
+        width, height, maxval = int(m.group(2)), int(m.group(3)), int(m.group(4))
+        if m.group(1) == b"P5": #cv2.imread expands gray to 3 channels, a mapped PGM would use other slots
+            raise SteganographyException("Gray PGM carriers can't be mapped, convert them to PPM")
+        if maxval > 255:
+            raise SteganographyException("Only 8 bit PPM carriers can be mapped")
+        im = np.memmap(path, np.uint8, mode, m.end(), (height, width, 3))
+        return im[:, :, ::-1] #RGB on disk, BGR like cv2.imread
+    raise SteganographyException(f"'{path}' is not an uncompressed BMP, PPM or NPY file")
+
+def read_manifest(path): #Yield job dicts from a CSV (with header) or JSONL manifest
+    with open(path, newline="") as f:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def run_job(job, png_level=None, png_strategy=None, compression=None, level=None): #Encode (payload given) or decode one manifest entry, timing each stage
+    timings = {}
+    start = time.perf_counter()
+    img = cv2.imread(job["input"])
+    if img is None:
+        raise SteganographyException(f"Could not read input file '{job['input']}'")
+    timings["read"] = time.perf_counter() - start
+    steg = LSBSteg(img)
+    start = time.perf_counter()
+    if job.get("payload"):
+        with open(job["payload"], "rb") as f:
+            res = steg.encode_stream(f, compression=job.get("compress") or compression, level=level)
+            nbbytes = f.tell()
+        timings["embed"] = time.perf_counter() - start
+        start = time.perf_counter()
+        out_f = os.path.splitext(job["output"])[0] + '.png'
+        write_png(out_f, res, png_level, png_strategy)
+        timings["write"] = time.perf_counter() - start
+    else:
+        out_f = job["output"]
+        with open(out_f, "wb") as f:
+            nbbytes = steg.decode_stream(f)
+        timings["extract"] = time.perf_counter() - start #Includes writing the extracted file
+    return out_f, nbbytes, timings
+
+def run_batch(jobs, processes=None, inflight=None, png_level=None, png_strategy=None, compression=None, level=None):
+    #Run jobs on a process pool with at most inflight of them queued
+    processes = processes or os.cpu_count()
+    inflight = inflight or 2 * processes
+    done_jobs = failed = nbbytes = 0
+    start = time.perf_counter()
+
+    def report(futures):
+        nonlocal done_jobs, failed, nbbytes
+        for future in futures:
+            job = pending.pop(future)
+            try:
+                out_f, size, timings = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {job.get('input')}: {e}")
+                continue
+            done_jobs += 1
+            nbbytes += size
+            stages = " ".join(f"{k} {v:.3f}s" for k, v in timings.items())
+            print(f"{job['input']} -> {out_f}: {size} bytes, {stages}")
+
+    pending = {}
+    with ProcessPoolExecutor(processes) as pool:
+        for job in jobs:
+            if len(pending) >= inflight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                report(done)
+            pending[pool.submit(run_job, job, png_level, png_strategy, compression, level)] = job
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            report(done)
+
+    elapsed = time.perf_counter() - start
+    print(f"{done_jobs} jobs done, {failed} failed in {elapsed:.2f}s: "
+          f"{done_jobs / elapsed:.1f} jobs/s, {nbbytes / elapsed / 1e6:.1f} MB/s of payload")
+    return done_jobs, failed
+
+def print_info(in_f, data_f=None, mmap=False): #Capacity of a carrier, and what hiding data_f in it would cost
+    img = memmap_carrier(in_f, "r") if mmap else cv2.imread(in_f)
+    if img is None:
+        raise SteganographyException(f"Could not read input file '{in_f}'")
+    steg = LSBSteg(img)
+    print(f"Carrier: {steg.width}x{steg.height}, {steg.nbchannels} channels, {steg.nbslots} slots per bit plane")
+    for k, capacity in enumerate(steg.plan(0)["capacity"], 1):
+        print(f"  {k} plane{'s' if k > 1 else ' '}: {capacity} bytes")
+    if data_f:
+        nbbytes = os.path.getsize(data_f)
+        plan = steg.plan(nbbytes)
+        if not plan["fits"]:
+            print(f"'{data_f}' ({nbbytes} bytes) does not fit in this carrier")
+            return
+        print(f"'{data_f}' ({nbbytes} bytes): {plan['slots']} slots over {plan['planes']} bit plane(s), "
+              f"expected MSE {plan['mse']:.4f}, PSNR {plan['psnr']:.1f} dB")
+
 def main():
     args = docopt.docopt(__doc__, version="0.2")
+    png_level = args["--png-level"] and int(args["--png-level"])
+    png_strategy = args["--png-strategy"]
+    compression = args["--compress"]
+    level = args["--level"] and int(args["--level"])
+    if args["batch"]:
+        run_batch(read_manifest(args["--manifest"]), int(args["--processes"] or 0), int(args["--inflight"] or 0),
+                  png_level, png_strategy, compression, level)
+        return
+
     in_f = args["--in"]
     out_f = args["--out"]
-    in_img = cv2.imread(in_f)
+    if args["info"]:
+        print_info(in_f, args["--file"], args["--mmap"])
+        return
+    workers = int(args["--workers"])
+    if args["--mmap"]:
+        in_img = memmap_carrier(in_f, "r+" if args["encode"] else "r")
+    else:
+        in_img = cv2.imread(in_f)
     if in_img is None:
         print(f"Error: Could not read input file '{in_f}'. Make sure the file exists and is a valid image.")
         return
@@ -173,22 +775,26 @@ def main():
     steg = LSBSteg(in_img)
     
     if args['encode']:
-        data = open(args["--file"], "rb").read()
-        res = steg.encode_binary(data)
+        with open(args["--file"], "rb") as f:
+            res = steg.encode_stream(f, workers=workers, compression=compression, level=level)
+
+        if args["--mmap"]:
+            res.flush()
+            print(f"Encoded in place into '{in_f}'")
+            return
         
         # Ensure the output file has a .png extension
         out_f = os.path.splitext(out_f)[0] + '.png'
         
         try:
-            cv2.imwrite(out_f, res)
+            write_png(out_f, res, png_level, png_strategy)
             print(f"Encoded image saved as '{out_f}'")
         except Exception as e:
             print(f"Error saving encoded image: {str(e)}")
     
     elif args['decode']:
-        raw = steg.decode_binary()
         with open(out_f, "wb") as f:
-            f.write(raw)
+            steg.decode_stream(f, workers)
         print(f"Decoded data saved to '{out_f}'")
 
 if __name__ == "__main__":
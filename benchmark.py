@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Usage:
+  benchmark.py decode [--sizes=<sizes>] [--repeat=<n>]
+  benchmark.py planes [--frame=<wxh>] [--repeat=<n>]
+  benchmark.py roi [--frame=<wxh>] [--repeat=<n>]
+  benchmark.py scanners [--frame=<wxh>] [--repeat=<n>]
+  benchmark.py prefilter [--frame=<wxh>] [--frames=<n>] [--top=<n>] [--seed=<n>]
+  benchmark.py compress [--frame=<wxh>] [--size=<size>] [--repeat=<n>]
+
+Options:
+  -h, --help                Show this help
+  --sizes=<sizes>           Comma separated payload sizes [default: 1K,10K,100K,1M,10M,50M]
+  --repeat=<n>              Runs per size, the best one is kept [default: 3]
+  --frame=<wxh>             Frame size for the bit plane split [default: 1920x1080]
+  --frames=<n>              Labelled frames, half of them hold a hidden QR [default: 100]
+  --top=<n>                 Candidates kept by the prefilter [default: 6]
+  --seed=<n>                Seed of the labelled fixture set [default: 0]
+  --size=<size>             Payload size of each kind [default: 2M]
+"""
+
+import math
+import os
+import time
+import tracemalloc
+
+import cv2
+import docopt
+import numpy as np
+
+from LSBSteg import HEADER_BITS, LSBSteg, SteganographyException, check_header
+from frame_sources import SyntheticSource, hide_qr, natural_frame, qr_image
+
+UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+def parse_size(txt): #"10K" -> 10240
+    txt = txt.strip().upper()
+    if txt[-1] in UNITS:
+        return int(txt[:-1]) * UNITS[txt[-1]]
+    return int(txt)
+
+def make_carrier(nbbytes, planes=1): #Random 3 channel carrier holding nbbytes (plus header) in the given planes
+    slots = math.ceil((nbbytes * 8 + HEADER_BITS + 1) / planes)
+    side = math.ceil(math.sqrt(slots / 3))
+    return np.random.randint(0, 256, (side, side, 3), np.uint8)
+
+def best_of(repeat, fn): #Best wall time over repeat runs, and the last result
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+def bench_decode(sizes, repeat):
+    print(f"{'payload':>10} {'decode (s)':>11} {'MB/s':>9} {'ns/byte':>9}")
+    for size in sizes:
+        data = np.random.bytes(size)
+        stego = LSBSteg(make_carrier(size)).encode_binary(data)
+        elapsed, out = best_of(repeat, lambda: LSBSteg(stego).decode_binary())
+        if out != data:
+            raise AssertionError(f"Decoded payload differs for {size} bytes")
+        print(f"{size:>10} {elapsed:>11.4f} {size / elapsed / 1e6:>9.1f} {elapsed / size * 1e9:>9.2f}")
+
+def peak_alloc(fn): #Peak bytes allocated by one call of fn
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def bench_planes(width, height, repeat): #Bit plane preprocessing of enhanced_qr for the 24 planes of a frame
+    from enhanced_qr import BitPlanes, binarize_plane, extract_lsb, plane_buffer
+    frame = np.random.randint(0, 256, (height, width, 3), np.uint8)
+
+    def extract(): #Baseline loop: one extract_lsb per plane, channels sliced out of it
+        for bit_plane in range(8):
+            lsb_frame = extract_lsb(frame, bit_plane)
+            for channel in range(3):
+                np.ascontiguousarray(lsb_frame[:, :, channel]) #pyzbar copies the strided slice anyway
+    def reuse(): #What read_plane_qr does for a candidate: the plane goes to the process's plane buffer
+        for bit_plane in range(8):
+            for channel in range(3):
+                binarize_plane(frame, bit_plane, channel, plane_buffer(height, width))
+    bit_planes = BitPlanes()
+    split = lambda: bit_planes.split(frame) #What full sweep frames do
+    reuse() #Buffers are allocated once, on the first frame
+    split()
+
+    print(f"{'method':>10} {'ms/frame':>9} {'peak MB':>9} {'speedup':>8}")
+    baseline = None
+    for name, fn in (("extract", extract), ("reuse", reuse), ("split", split)):
+        elapsed, _ = best_of(repeat, fn)
+        baseline = baseline or elapsed
+        print(f"{name:>10} {elapsed * 1e3:>9.2f} {peak_alloc(fn) / 1e6:>9.1f} {baseline / elapsed:>7.1f}x")
+
+def bench_prefilter(width, height, nbframes, top, seed): #Recall and skip rate of rank_planes on labelled frames
+    from enhanced_qr import rank_planes
+    rng = np.random.default_rng(seed)
+    kept, elapsed, hits, misses = 0, 0.0, {}, []
+    for i in range(nbframes):
+        frame = natural_frame(rng, width, height)
+        label = None
+        if i % 2 == 0: #Even frames hold a QR in one of the 4 low planes, modules of 2 to 6 pixels
+            label = (int(rng.integers(0, 4)), int(rng.integers(0, 3)), int(rng.integers(2, 7)))
+            hide_qr(rng, frame, f"https://example.com/{i}", *label)
+        start = time.perf_counter()
+        candidates = rank_planes(frame, top=top)
+        elapsed += time.perf_counter() - start
+        kept += len(candidates)
+        if label:
+            found = label[:2] in candidates
+            total, ok = hits.get(label[2], (0, 0))
+            hits[label[2]] = (total + 1, ok + found)
+            if not found:
+                misses.append(label)
+
+    print(f"{'module px':>10} {'frames':>7} {'recall':>7}")
+    for module in sorted(hits):
+        total, ok = hits[module]
+        print(f"{module:>10} {total:>7} {ok / total:>7.2f}")
+    total = sum(t for t, _ in hits.values())
+    print(f"recall {sum(ok for _, ok in hits.values()) / total:.2f}, skip rate {1 - kept / (nbframes * 24):.2f}, "
+          f"{elapsed / nbframes * 1e3:.1f} ms/frame")
+    for bit_plane, channel, module in misses:
+        print(f"missed: bit plane {bit_plane}, channel {channel}, {module}px modules")
+
+def bench_roi(width, height, repeat): #pyzbar on a whole frame against RoiTracker on the region of the code
+    from enhanced_qr import RoiTracker, decode
+    rng = np.random.default_rng(0)
+    frame = natural_frame(rng, width, height)
+    qr = cv2.copyMakeBorder(qr_image("https://example.com/roi", 8), 32, 32, 32, 32, cv2.BORDER_CONSTANT, value=255) #Quiet zone
+    y, x = height // 3, width // 3
+    frame[y:y + qr.shape[0], x:x + qr.shape[1]] = qr[:, :, np.newaxis]
+    tracker = RoiTracker(reacquire_every=repeat + 1)
+    if not tracker.decode(frame):
+        raise AssertionError("pyzbar did not find the benchmark QR")
+
+    print(f"{'method':>10} {'ms/frame':>9}")
+    for name, fn in (("full", lambda: decode(frame)), ("roi", lambda: tracker.decode(frame))):
+        elapsed, found = best_of(repeat, fn)
+        if not found:
+            raise AssertionError(f"{name} decode lost the benchmark QR")
+        print(f"{name:>10} {elapsed * 1e3:>9.2f}")
+
+CODECS = ((None, None), ("zlib", 1), ("zlib", 6), ("zlib", 9), ("lzma", 0), ("lzma", 6)) #(compression, level) pairs compared
+
+def payloads(size, rng): #Payload kinds, from very compressible to not at all
+    frame = natural_frame(rng, 1920, 1080)
+    records = b"".join(b'{"id": %d, "frame": %d, "content": "https://example.com/%d"}\n' % (i, i // 3, rng.integers(1000))
+                       for i in range(size // 40 + 1))
+    return {"jsonl": records[:size],
+            "pixels": np.resize(frame.reshape(-1), size).tobytes(), #Raw BGR, what encode_image hides
+            "png": np.resize(cv2.imencode(".png", frame)[1], size).tobytes(),
+            "random": rng.bytes(size)}
+
+def bench_compress(width, height, size, repeat): #Encode time against slots, planes and distortion saved by compressing the payload
+    carrier = natural_frame(np.random.default_rng(0), width, height)
+    print(f"{'payload':>8} {'codec':>7} {'stored':>9} {'ratio':>6} {'slots':>10} {'planes':>6} {'PSNR dB':>8} {'encode ms':>10} {'decode ms':>10}")
+    for kind, data in payloads(size, np.random.default_rng(0)).items():
+        for compression, level in CODECS:
+            encode = lambda: LSBSteg(carrier.copy()).encode_binary(data, compression=compression, level=level) #The copy costs the same for every codec
+            try:
+                elapsed, stego = best_of(repeat, encode)
+            except SteganographyException as e: #Doesn't fit
+                print(f"{kind:>8} {compression or 'none':>7} does not fit: {e}")
+                continue
+            decoded, out = best_of(repeat, lambda: LSBSteg(stego).decode_binary())
+            if out != data:
+                raise AssertionError(f"Decoded {kind} payload differs with {compression}")
+            stored = check_header(stego)
+            plan = LSBSteg(carrier).plan(stored)
+            name = f"{compression}:{level}" if compression else "none"
+            print(f"{kind:>8} {name:>7} {stored:>9} {size / stored:>6.2f} {plan['slots']:>10} {plan['planes']:>6} "
+                  f"{plan['psnr']:>8.1f} {elapsed * 1e3:>10.1f} {decoded * 1e3:>10.1f}")
+
+SCANNERS = ( #Extraction step of every LSB scanner: module, function, call on a frame
+    ("lsb_qr_scanner", "extract_hidden_data", lambda fn, path, frame: fn(path)),
+    ("lsb_qr_url_opener", "extract_lsb_data", lambda fn, path, frame: fn(frame)),
+    ("lsb_realtime_qr_scanner", "extract_hidden_data", lambda fn, path, frame: fn(frame, verbose=False)),
+    ("progressive_lsb_qr_scanner", "extract_lsb_data", lambda fn, path, frame: fn(frame, verbose=False)),
+)
+
+def bench_scanners(width, height, repeat): #Every scanner on a frame holding a QR PNG, and on a noise frame
+    import importlib
+    import tempfile
+    frames = {"stego": SyntheticSource(width, height, frames=1, plane=None, variants=1).read()[1],
+              "noise": np.random.randint(0, 256, (height, width, 3), np.uint8)}
+    print(f"{'scanner':>28} {'frame':>6} {'ms':>9} {'bytes':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for module, name, call in SCANNERS:
+            try:
+                fn = getattr(importlib.import_module(module), name)
+            except (ImportError, SystemExit) as e: #pyzbar, or tkinter for the URL opener
+                print(f"{module:>28} skipped: {e}")
+                continue
+            for label, frame in frames.items():
+                path = os.path.join(tmp, f"{label}.png") #lsb_qr_scanner reads a file, imread is part of its time
+                cv2.imwrite(path, frame)
+                def run():
+                    try:
+                        return call(fn, path, frame)
+                    except ValueError: #lsb_qr_scanner raises on noise
+                        return None
+                elapsed, data = best_of(repeat, run)
+                print(f"{module:>28} {label:>6} {elapsed * 1e3:>9.3f} {len(data) if data else 0:>7}")
+
+def main():
+    args = docopt.docopt(__doc__)
+    repeat = int(args["--repeat"])
+    if args["decode"]:
+        bench_decode([parse_size(s) for s in args["--sizes"].split(",")], repeat)
+    elif args["planes"]:
+        width, height = (int(v) for v in args["--frame"].split("x"))
+        bench_planes(width, height, repeat)
+    elif args["roi"]:
+        width, height = (int(v) for v in args["--frame"].split("x"))
+        bench_roi(width, height, repeat)
+    elif args["scanners"]:
+        width, height = (int(v) for v in args["--frame"].split("x"))
+        bench_scanners(width, height, repeat)
+    elif args["compress"]:
+        width, height = (int(v) for v in args["--frame"].split("x"))
+        bench_compress(width, height, parse_size(args["--size"]), repeat)
+    elif args["prefilter"]:
+        width, height = (int(v) for v in args["--frame"].split("x"))
+        bench_prefilter(width, height, int(args["--frames"]), int(args["--top"]), int(args["--seed"]))
+
+if __name__ == "__main__":
+    main()
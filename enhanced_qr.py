@@ -1,11 +1,34 @@
+"""
+Usage:
+  enhanced_qr.py [--source=<src>] [--processes=<n>] [--queue=<n>] [--queue-policy=<p>] [--headless] [--output=<jsonl>]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --processes=<n>           Processes decoding the planes of a frame, 0 uses every core, 1 decodes in the scan thread [default: 0]
+  --queue=<n>               Frames buffered between capture and the worker [default: 1]
+  --queue-policy=<p>        When the buffer is full: block until the worker catches up, drop-oldest, or latest to keep
+                            only the newest frame. Cameras default to drop-oldest, other sources to block
+  --headless                No windows and no per-frame output, results go to --output (stdout by default)
+  --output=<jsonl>          Append results to this JSON Lines file, - for stdout
+"""
+
 import os
 import sys
 import cv2
+import docopt
 import numpy as np
 import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
 from threading import Thread, Event
 from queue import Queue, Empty
 
+from frame_sources import FrameQueue, default_policy, open_source
+from result_sinks import open_sink, status_printer
+
 # Set the path for zbar library
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
@@ -22,6 +45,100 @@ except ImportError as e:
 def extract_lsb(img, bit_plane=0):
     return np.bitwise_and(img, 1 << bit_plane).astype(np.uint8) * 255
 
+def binarize_plane(frame, bit_plane, channel, out=None):
+    # 0/255 image of one (bit plane, channel) of frame, written into out when given
+    out = np.right_shift(frame[:, :, channel], bit_plane, out=out)
+    out &= 1
+    np.negative(out, out=out)  # 1 -> 255 in uint8
+    return out
+
+_plane_buffer = np.empty(0, np.uint8)  # This process's plane buffer, grown to the largest plane read so far
+
+def plane_buffer(height, width):
+    # Contiguous (height, width) view of the plane buffer, reused by every candidate of every frame
+    global _plane_buffer
+    if _plane_buffer.size < height * width:
+        _plane_buffer = np.empty(height * width, np.uint8)
+    return _plane_buffer[:height * width].reshape(height, width)
+
+class BitPlanes:
+    # Splits frames into 0/255 images of every (bit plane, channel) in one pass, into
+    # buffers reused from one frame to the next (or into out) instead of 24 new arrays.
+    # Full sweep frames decode every plane, so they are split this way.
+    shifts = np.arange(8, dtype=np.uint8).reshape(8, 1, 1, 1)
+
+    def __init__(self):
+        self.channels = None  # Frame copied channel-major, (channels, height, width)
+        self.planes = None    # (8, channels, height, width): planes[bit_plane, channel] is contiguous
+
+    def split(self, frame, out=None):
+        height, width, channels = frame.shape
+        if self.channels is None or self.channels.shape != (channels, height, width):
+            self.channels = np.empty((channels, height, width), np.uint8)
+            self.planes = None
+        if out is None:
+            if self.planes is None:
+                self.planes = np.empty((8, channels, height, width), np.uint8)
+            out = self.planes
+        np.copyto(self.channels, frame.transpose(2, 0, 1))
+        np.right_shift(self.channels, self.shifts, out=out)
+        out &= 1
+        np.negative(out, out=out)  # 1 -> 255 in uint8
+        return out
+
+PLANE_BITS = ((np.arange(256)[:, np.newaxis] >> np.arange(8)) & 1).astype(np.float64)  # Byte value -> its 8 bits
+
+@lru_cache(maxsize=4)
+def tile_index(rows, pairs, channels, tile_rows, tile_pairs):
+    # Histogram offset of every sampled (row, pixel pair, channel): 256 bins per (tile, channel)
+    r = np.arange(rows)[:, np.newaxis, np.newaxis] // tile_rows
+    w = np.arange(pairs)[np.newaxis, :, np.newaxis] // tile_pairs
+    c = np.arange(channels)[np.newaxis, np.newaxis, :]
+    return ((r * (pairs // tile_pairs) + w) * channels + c) * 256
+
+def rank_planes(frame, top=6, min_score=0.1, max_plane=8, step=4, tile=32):
+    # Cheap QR likelihood of every (bit plane, channel), without pyzbar.
+    # In a natural frame the chance that two neighbouring pixels differ in a bit
+    # plane grows steadily from the MSB to sensor noise (~0.5) in the LSBs. A QR
+    # code has flat modules, so in the tile holding it its plane flips much less
+    # often than the plane right above it. Rates are counted on horizontal pixel
+    # pairs of every step-th row, per tile x tile block, and the best tile wins.
+    # Pairs starting on even and on odd columns are counted apart and the lower rate
+    # kept: 2 pixel modules straddle every pair of one parity but none of the other.
+    # Returns up to top (bit_plane, channel) candidates, most likely first, or every
+    # plane of a frame too small to hold one tile.
+    height, width, channels = frame.shape
+    tiles_y, tiles_x = height // tile, (width - 1) // tile
+    if tiles_y == 0 or tiles_x == 0:
+        return [(bit_plane, channel) for bit_plane in range(max_plane) for channel in range(channels)]
+    rows = frame[:tiles_y * tile:step, :tiles_x * tile + 1]
+    left = rows[:, :-1]
+    flips = left ^ rows[:, 1:]
+    base = tile_index(rows.shape[0], tiles_x * tile // 2, channels, tile // step, tile // 2)
+    samples = (tile // step) * (tile // 2)
+
+    def rates(values):  # Fraction of set bits per (tile, channel, bit plane)
+        hist = np.bincount((base + values).ravel(), minlength=tiles_y * tiles_x * channels * 256)
+        return (hist.reshape(-1, 256) @ PLANE_BITS).reshape(-1, channels, 8) / samples
+
+    flips, ones = np.minimum(rates(flips[:, 0::2]), rates(flips[:, 1::2])), rates(left[:, 0::2])
+    above = np.concatenate([flips[:, :, 1:], flips[:, :, 7:]], axis=2)
+    below = np.concatenate([2 * flips[:, :, :1], flips[:, :, :7]], axis=2)
+    anomaly = np.maximum(above - flips, below - 2 * flips)
+    anomaly[(ones < 0.2) | (ones > 0.8)] = 0  # Flat tiles (sky, saturation) flip rarely in every plane
+    score = anomaly.max(axis=0)[:, :max_plane]
+    order = np.argsort(-score, axis=None, kind="stable")[:top]
+    channel, plane = np.unravel_index(order, score.shape)
+    return [(int(p), int(c)) for c, p in zip(channel, plane) if score[c, p] >= min_score]
+
+FULL_SWEEP_EVERY = 10  # Every 10th frame all planes go to pyzbar, so a code ranked too low is still found
+
+def candidate_planes(frame, frame_index, max_plane=8):
+    # Prefiltered candidates, or every plane (most likely first) on a full sweep frame
+    if frame_index % FULL_SWEEP_EVERY == 0:
+        return rank_planes(frame, top=max_plane * frame.shape[2], min_score=float("-inf"), max_plane=max_plane)
+    return rank_planes(frame, max_plane=max_plane)
+
 def decode_qr_content(content):
     # Print raw content for debugging
     print(f"Raw QR content: {repr(content)}")
@@ -29,72 +146,284 @@ def decode_qr_content(content):
     # Return the content directly without any processing
     return f"QR Code Content: {content}"
 
-def find_and_decode_qr(img):
+def read_qr(img):
+    # (raw content, (left, top, width, height)) of the first QR in img, or None
     try:
         decoded_objects = decode(img)
         for obj in decoded_objects:
-            raw_content = obj.data.decode('utf-8')
-            return decode_qr_content(raw_content)
+            return obj.data.decode('utf-8'), tuple(obj.rect)
     except Exception as e:
-        print(f"Error decoding QR code: {e}")
+        print(f"Error decoding QR code: {e}", file=sys.stderr)  # Also runs headless and in pool workers
     return None
 
-def process_frame(frame_queue, result_queue, stop_event):
+def find_and_decode_qr(img):
+    qr = read_qr(img)
+    return decode_qr_content(qr[0]) if qr else None
+
+def shift_qr(obj, x, y):
+    # pyzbar result found in a crop, moved to the coordinates of the full frame
+    left, top, width, height = obj.rect
+    return obj._replace(rect=(left + x, top + y, width, height),
+                        polygon=[(px + x, py + y) for px, py in obj.polygon])
+
+class RoiTracker:
+    # Last QR bounding box of a stream. Frames are decoded on that box grown by margin
+    # (a fraction of its size on each side), and on the whole frame again after a miss
+    # or once reacquire_every cropped decodes went by.
+    def __init__(self, margin=0.5, reacquire_every=30):
+        self.margin = margin
+        self.reacquire_every = reacquire_every
+        self.rect = None  # (left, top, width, height) in frame coordinates
+        self.age = 0      # Cropped decodes since the last full frame one
+
+    def window(self, shape):
+        # (top, bottom, left, right) of the region to decode, None for the whole frame
+        if self.rect is None or self.age >= self.reacquire_every:
+            return None
+        left, top, width, height = self.rect
+        dx, dy = int(width * self.margin) + 1, int(height * self.margin) + 1
+        return max(top - dy, 0), min(top + height + dy, shape[0]), max(left - dx, 0), min(left + width + dx, shape[1])
+
+    def update(self, rects, window):
+        # Codes found (frame coordinates) by a decode of window
+        self.age = 0 if window is None else self.age + 1
+        if not rects:
+            self.rect = None
+            return
+        left = min(r[0] for r in rects)
+        top = min(r[1] for r in rects)
+        self.rect = (left, top, max(r[0] + r[2] for r in rects) - left, max(r[1] + r[3] for r in rects) - top)
+
+    def decode(self, img):
+        # pyzbar decode of img, on the tracked box only when there is one
+        window = self.window(img.shape)
+        if window is None:
+            decoded_objects = decode(img)
+        else:
+            top, bottom, left, right = window
+            decoded_objects = [shift_qr(obj, left, top) for obj in decode(img[top:bottom, left:right])]
+        self.update([obj.rect for obj in decoded_objects], window)
+        return decoded_objects
+
+_attached = {}  # Pool process side: the shared frame block, by name
+
+def _shared_frame(name, shape):
+    shm = _attached.get(name)
+    if shm is None:  # The scanner moved to a bigger block, drop the old one
+        for old in _attached.values():
+            old.close()
+        _attached.clear()
+        shm = _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, np.uint8, buffer=shm.buf)
+
+def read_plane_qr(frame, bit_plane, channel, window=None):
+    # read_qr of one plane of frame, only inside window (see RoiTracker) when given.
+    # The plane goes to this process's plane buffer, nothing is allocated per candidate.
+    top, left = 0, 0
+    if window is not None:
+        top, bottom, left, right = window
+        frame = frame[top:bottom, left:right]
+    qr = read_qr(binarize_plane(frame, bit_plane, channel, plane_buffer(*frame.shape[:2])))
+    if qr is None:
+        return None
+    x, y, width, height = qr[1]
+    return qr[0], (x + left, y + top, width, height)
+
+def _decode_plane(name, shape, bit_plane, channel, window):
+    # Runs in a pool process: read_plane_qr on the shared frame
+    return read_plane_qr(_shared_frame(name, shape), bit_plane, channel, window)
+
+def _decode_split(name, shape, bit_plane, channel):
+    # Runs in a pool process: read_qr of one plane of the shared BitPlanes split
+    return read_qr(_shared_frame(name, shape)[bit_plane, channel])
+
+class PlanePool:
+    # Decodes the candidate planes of a frame in parallel. The frame is copied once into
+    # shared memory, tasks only carry its name and the (bit plane, channel) to read.
+    def __init__(self, processes=None):
+        self.executor = ProcessPoolExecutor(processes) if processes != 1 else None
+        self.shm = None
+        self.bit_planes = BitPlanes()
+
+    def shared(self, shape):
+        # uint8 array of shape in the shared block, which grows when it is too small
+        nbytes = int(np.prod(shape))
+        if self.shm is None or self.shm.size < nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return np.ndarray(shape, np.uint8, buffer=self.shm.buf)
+
+    def decode(self, frame, candidates, windows=None, split=False):
+        # read_plane_qr result of every candidate, in the order of candidates. With split
+        # (full sweeps) the frame is split into all its planes at once and windows are ignored.
+        if not candidates:
+            return []
+        if split:
+            return self.decode_split(frame, candidates)
+        windows = windows or [None] * len(candidates)
+        if self.executor is None:
+            return [read_plane_qr(frame, bit_plane, channel, window)
+                    for (bit_plane, channel), window in zip(candidates, windows)]
+        np.copyto(self.shared(frame.shape), frame)
+        return list(self.executor.map(_decode_plane, *zip(*[(self.shm.name, frame.shape, bit_plane, channel, window)
+                                                            for (bit_plane, channel), window in zip(candidates, windows)])))
+
+    def decode_split(self, frame, candidates):
+        if self.executor is None:
+            planes = self.bit_planes.split(frame)
+            return [read_qr(planes[bit_plane, channel]) for bit_plane, channel in candidates]
+        shape = (8, frame.shape[2], *frame.shape[:2])
+        self.bit_planes.split(frame, self.shared(shape))
+        return list(self.executor.map(_decode_split, *zip(*[(self.shm.name, shape, bit_plane, channel)
+                                                            for bit_plane, channel in candidates])))
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HintCache:
+    # Where codes were last found in a stream, as (bit_plane, channel) -> [RoiTracker, misses].
+    # Hints are tried before any search, on their tracked region; a hint that misses
+    # max_misses frames in a row is dropped, and only the size most recently hit are kept.
+    def __init__(self, size=4, max_misses=5):
+        self.size = size
+        self.max_misses = max_misses
+        self.hints = OrderedDict()  # Least recently hit first
+
+    def candidates(self):
+        return list(reversed(self.hints))
+
+    def window(self, bit_plane, channel, shape):
+        hint = self.hints.get((bit_plane, channel))
+        return hint[0].window(shape) if hint else None
+
+    def hit(self, bit_plane, channel, roi, window=None):
+        hint = self.hints.get((bit_plane, channel)) or [RoiTracker(), 0]
+        hint[0].update([roi], window)
+        self.hints[bit_plane, channel] = [hint[0], 0]
+        self.hints.move_to_end((bit_plane, channel))
+        while len(self.hints) > self.size:
+            self.hints.popitem(last=False)
+
+    def miss(self, bit_plane, channel, window=None):
+        hint = self.hints.get((bit_plane, channel))
+        if hint is not None:
+            hint[0].update([], window)  # Next try is on the whole plane
+            hint[1] += 1
+            if hint[1] >= self.max_misses:
+                del self.hints[bit_plane, channel]
+
+def decode_candidates(frame, pool, hints, candidates, windows, split=False):
+    # Decodes candidates, records each hit or miss in hints and returns the codes found
+    found = []
+    for (bit_plane, channel), window, qr in zip(candidates, windows, pool.decode(frame, candidates, windows, split)):
+        if qr:
+            hints.hit(bit_plane, channel, qr[1], window)
+            found.append((qr[0], bit_plane, channel))
+        else:
+            hints.miss(bit_plane, channel, window)
+    return found
+
+def search_frame(frame, pool, hints, frame_index, max_plane=8):
+    # Hinted planes first, each on the region its code was last seen in. When none of
+    # them holds a code, the prefiltered candidates are decoded as well, and on a full
+    # sweep frame every plane is decoded whole from one BitPlanes split, hints or not, so
+    # a new code in another plane is still found. Returns the codes found as (raw content, bit_plane, channel)
+    # and the number of planes decoded.
+    hinted, tried = [], []
+    sweep = frame_index % FULL_SWEEP_EVERY == 0
+    if not sweep:
+        hinted = hints.candidates()
+        windows = [hints.window(bit_plane, channel, frame.shape) for bit_plane, channel in hinted]
+        found = decode_candidates(frame, pool, hints, hinted, windows)
+        if found:
+            return found, len(hinted)
+        tried = [plane for plane, window in zip(hinted, windows) if window is None]  # Others only saw a region
+    candidates = [c for c in candidate_planes(frame, frame_index, max_plane) if c not in tried]
+    found = decode_candidates(frame, pool, hints, candidates, [None] * len(candidates), sweep)
+    return found, len(hinted) + len(candidates)
+
+def process_frame(frame_queue, result_queue, stop_event, pool, sink=None, verbose=True):
+    # result_queue gets the codes of each frame for display, sink one record per code
+    hints = HintCache()
+    frame_index = 0
     while not stop_event.is_set():
         try:
             frame = frame_queue.get(timeout=1)
             start_time = time.time()
             
-            all_data = []
-            for bit_plane in range(8):  # Check all 8 bit planes
-                lsb_frame = extract_lsb(frame, bit_plane)
-                
-                for channel in range(3):
-                    qr_data = find_and_decode_qr(lsb_frame[:,:,channel])
-                    if qr_data:
-                        all_data.append((qr_data, bit_plane, channel))
-                
-                # Try all channels combined
-                qr_data = find_and_decode_qr(lsb_frame)
-                if qr_data:
-                    all_data.append((qr_data, bit_plane, -1))
+            # Only the most QR-like planes go to pyzbar. The old combined channel pass
+            # is gone: pyzbar reads channel 0 of a 3D array, which is already checked.
+            found, decoded = search_frame(frame, pool, hints, frame_index)
+            frame_index += 1
+            if sink:
+                for raw_content, bit_plane, channel in found:
+                    sink({"content": raw_content, "bit_plane": bit_plane, "channel": channel})
+            if not verbose:
+                frame_queue.task_done()
+                continue
+            all_data = [(decode_qr_content(raw_content), bit_plane, channel) for raw_content, bit_plane, channel in found]
             
             if all_data:
                 print("All detected QR codes:")
                 for data, bit_plane, channel in all_data:
                     print(f"Bit plane {bit_plane}, channel {channel}: {data}")
-                result_queue.put(all_data)
+                if result_queue is not None:
+                    result_queue.put(all_data)
             else:
                 print("No hidden QR Code detected in this frame")
             
             elapsed = time.time() - start_time
-            print(f"Frame processed in {elapsed:.2f} seconds")
+            print(f"Frame processed in {elapsed:.2f} seconds ({decoded}/{8 * frame.shape[2]} planes decoded)")
             
             frame_queue.task_done()
         except Empty:
             continue
         except Exception as e:
-            print(f"Error in process_frame: {e}")
+            print(f"Error in process_frame: {e}", file=sys.stderr)
+            frame_queue.task_done()
 
 def main():
-    print("Initializing camera...")
-    cap = cv2.VideoCapture(0)
+    args = docopt.docopt(__doc__)
+    processes = int(args["--processes"]) or None
+    headless = args["--headless"]
+    log = status_printer(headless)
+
+    log("Initializing camera...")
+    cap = open_source(args["--source"])
     
     if not cap.isOpened():
-        print("Error: Could not open camera.")
+        log("Error: Could not open camera.")
         return
 
-    print("Camera initialized successfully.")
-    print("LSB Hidden QR Code Detector is running. Press 'q' to quit.")
-
-    cv2.namedWindow('LSB QR Scanner', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('LSB QR Scanner', 640, 480)
+    log("Camera initialized successfully.")
+    if headless:
+        log("LSB Hidden QR Code Detector is running headless. Press Ctrl+C to quit.")
+    else:
+        log("LSB Hidden QR Code Detector is running. Press 'q' to quit.")
+        cv2.namedWindow('LSB QR Scanner', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('LSB QR Scanner', 640, 480)
 
-    frame_queue = Queue(maxsize=1)
-    result_queue = Queue()
+    frame_queue = FrameQueue(int(args["--queue"]), args["--queue-policy"] or default_policy(args["--source"]))
+    result_queue = None if headless else Queue()
     stop_event = Event()
+    pool = PlanePool(processes)
+    sink = open_sink(args)
 
-    worker = Thread(target=process_frame, args=(frame_queue, result_queue, stop_event))
+    worker = Thread(target=process_frame, args=(frame_queue, result_queue, stop_event, pool, sink, not headless))
     worker.start()
 
     last_qr_time = 0
@@ -106,7 +435,7 @@ def main():
         while True:
             ret, frame = cap.read()
             if not ret:
-                print("Failed to grab frame")
+                log("Failed to grab frame")
                 break
 
             frame_count += 1
@@ -114,22 +443,25 @@ def main():
             
             if frame_count % 30 == 0:  # Print FPS every 30 frames
                 fps = frame_count / (current_time - start_time)
-                print(f"FPS: {fps:.2f}")
+                log(f"FPS: {fps:.2f}")
                 frame_count = 0
                 start_time = current_time
 
+            if headless:
+                frame_queue.put(frame)
+                continue
+
             cv2.putText(frame, "Scanning for hidden QR...", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
-            if frame_queue.empty():
-                frame_queue.put(frame)
+            frame_queue.put(frame)
 
             if not result_queue.empty():
                 all_qr_data = result_queue.get()
                 if current_time - last_qr_time > qr_cooldown:
                     for qr_data, bit_plane, channel in all_qr_data:
-                        print(f"Hidden QR Code detected:")
-                        print(f"{qr_data}")
-                        print(f"Bit Plane: {bit_plane}, Channel: {channel if channel != -1 else 'All'}")
+                        log(f"Hidden QR Code detected:")
+                        log(f"{qr_data}")
+                        log(f"Bit Plane: {bit_plane}, Channel: {channel if channel != -1 else 'All'}")
                         
                         # Display the detected QR code
                         display_frame = cv2.cvtColor(extract_lsb(frame, bit_plane), cv2.COLOR_BGR2GRAY) if channel != -1 else extract_lsb(frame, bit_plane)
@@ -143,15 +475,24 @@ def main():
             cv2.imshow('LSB QR Scanner', frame)
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("Quit key pressed.")
+                log("Quit key pressed.")
                 break
 
+    except KeyboardInterrupt:
+        log("Interrupted.")
     finally:
+        if headless:
+            frame_queue.join()  # Finish the last frame of a file or synthetic source
         stop_event.set()
         worker.join()
+        log(frame_queue.summary())
+        pool.close()
+        if sink:
+            sink.close()
         cap.release()
-        cv2.destroyAllWindows()
-        print("Camera released and windows closed.")
+        if not headless:
+            cv2.destroyAllWindows()
+        log("Camera released and windows closed.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
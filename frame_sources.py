@@ -0,0 +1,205 @@
+# Frame sources for the scanners. Every source reads like cv2.VideoCapture
+# (isOpened, read -> (ret, frame), release), so a scanner can run on a camera,
+# a video file, a folder of images or synthetic frames without any change.
+
+import glob
+import os
+import sys
+import time
+from collections import deque
+from queue import Empty
+from threading import Condition
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".bmp", ".tif", ".tiff", ".jpg", ".jpeg", ".ppm", ".pgm")
+
+class ImageSource:
+    # Images of a directory, or matching a glob pattern, in name order, one per read
+    def __init__(self, pattern):
+        if os.path.isdir(pattern):
+            paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            paths = glob.glob(pattern)
+        self.paths = sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+        self.index = 0
+
+    def isOpened(self):
+        return self.index < len(self.paths)
+
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index], cv2.IMREAD_COLOR)
+            self.index += 1
+            if frame is not None:
+                return True, frame
+            print(f"Skipping unreadable image {self.paths[self.index - 1]}", file=sys.stderr)
+        return False, None
+
+    def release(self):
+        self.index = len(self.paths)
+
+def natural_frame(rng, width, height):  # Smooth colour gradients plus sensor noise, like a camera frame
+    y, x = np.mgrid[0:height, 0:width]
+    base = 128 + 60 * np.sin(x / 97 + rng.uniform(0, 6)) + 50 * np.cos(y / 53 + rng.uniform(0, 6))
+    img = np.stack([base + rng.uniform(-30, 30) for _ in range(3)], axis=-1) + rng.normal(0, 3, (height, width, 3))
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def qr_image(text, module):  # Black on white QR of text, module pixels per module, no quiet zone
+    qr = cv2.QRCodeEncoder.create().encode(text)
+    return cv2.resize(qr, None, fx=module, fy=module, interpolation=cv2.INTER_NEAREST)
+
+def hide_qr(rng, frame, text, bit_plane, channel, module):  # QR of text written into one bit plane, at a random place
+    qr = qr_image(text, module)
+    h, w = qr.shape
+    y, x = rng.integers(0, frame.shape[0] - h), rng.integers(0, frame.shape[1] - w)
+    region = frame[y:y + h, x:x + w, channel]
+    region &= 255 ^ (1 << bit_plane)
+    region |= (qr > 0).astype(np.uint8) << bit_plane
+
+class SyntheticSource:
+    # Camera-like frames holding a known QR, for runs without hardware. With plane set,
+    # the QR is drawn straight into that bit plane of channel (what enhanced_qr looks
+    # for); with plane=None it is PNG encoded and hidden with LSBSteg.encode_binary
+    # (what the full frame LSB scanners decode). The same seed gives the same frames.
+    def __init__(self, width=1280, height=720, frames=300, text="https://example.com/synthetic",
+                 plane=0, channel=0, module=4, variants=4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.frames = frames
+        self.variants = []  # A few distinct frames, cycled so reads cost a copy only
+        for _ in range(variants):
+            frame = natural_frame(rng, width, height)
+            if plane is None:
+                from LSBSteg import LSBSteg
+                png = cv2.imencode(".png", qr_image(text, module))[1].tobytes()
+                frame = LSBSteg(frame).encode_binary(png)
+            else:
+                hide_qr(rng, frame, text, plane, channel, module)
+            self.variants.append(frame)
+        self.index = 0
+
+    def isOpened(self):
+        return self.index < self.frames
+
+    def read(self):
+        if self.index >= self.frames:
+            return False, None
+        frame = self.variants[self.index % len(self.variants)].copy()  # Scanners draw on their frames
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        self.index = self.frames
+
+def parse_synthetic(spec):  # "synthetic:plane=1,channel=2" -> SyntheticSource keyword arguments
+    kwargs = {}
+    for item in filter(None, spec.partition(":")[2].split(",")):
+        key, _, value = item.partition("=")
+        if key == "text":
+            kwargs[key] = value
+        elif key == "plane" and value in ("lsb", "none"):
+            kwargs[key] = None
+        elif key in ("width", "height", "frames", "plane", "channel", "module", "variants", "seed"):
+            kwargs[key] = int(value)
+        else:
+            raise ValueError(f"Unknown synthetic source option: {key}")
+    return kwargs
+
+def open_source(spec):
+    # Frame source from a command line spec:
+    #   0, 1, ...                    camera index
+    #   synthetic[:key=value,...]    SyntheticSource, e.g. synthetic:plane=1,channel=2,frames=500
+    #   a directory or a glob        ImageSource, e.g. "frames/*.png"
+    #   anything else                video file
+    spec = str(spec)
+    if spec.isdigit():
+        return cv2.VideoCapture(int(spec))
+    if spec == "synthetic" or spec.startswith("synthetic:"):
+        return SyntheticSource(**parse_synthetic(spec))
+    if os.path.isdir(spec) or glob.has_magic(spec):
+        return ImageSource(spec)
+    return cv2.VideoCapture(spec)
+
+QUEUE_POLICIES = ("block", "drop-oldest", "latest")
+
+def default_policy(spec):
+    # A camera keeps producing frames whether or not they are read, so it drops them.
+    # Files, directories and synthetic sources wait for the worker instead: every
+    # frame they hold gets scanned.
+    return "drop-oldest" if str(spec).isdigit() else "block"
+
+class FrameQueue:
+    # Bounded frame buffer between a capture loop and its workers. With "block", put
+    # waits while the buffer is full, which paces a finite source to its workers.
+    # Otherwise put never blocks: when the buffer is full the oldest frame is dropped
+    # ("drop-oldest"), and with "latest" every queued frame is replaced by the new one,
+    # so workers always get the freshest frames instead of lagging behind the source.
+    # get, task_done and join behave like queue.Queue; close makes get return None
+    # once drained and releases a blocked put, whose frame is then dropped.
+    def __init__(self, maxsize=1, policy="drop-oldest"):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown frame queue policy: {policy}")
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self.frames = deque()  # (frame, time it was queued)
+        self.cond = Condition()
+        self.closed = False
+        self.unfinished = 0
+        self.captured = 0
+        self.dropped = 0
+        self.processed = 0
+        self.wait_time = 0.0  # Seconds the frames handed to workers spent queued
+
+    def put(self, frame):
+        with self.cond:
+            self.captured += 1
+            if self.policy == "block":
+                self.cond.wait_for(lambda: len(self.frames) < self.maxsize or self.closed)
+                if self.closed:
+                    self.dropped += 1
+                    return
+            while self.frames and (self.policy == "latest" or len(self.frames) >= self.maxsize):
+                self.frames.popleft()
+                self.dropped += 1
+                self.unfinished -= 1
+            self.frames.append((frame, time.perf_counter()))
+            self.unfinished += 1
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frames or self.closed, timeout):
+                raise Empty
+            if not self.frames:
+                return None  # Closed and drained
+            frame, queued = self.frames.popleft()
+            self.cond.notify_all()  # Room for a blocked put
+            self.wait_time += time.perf_counter() - queued
+            return frame
+
+    def task_done(self):
+        with self.cond:
+            self.processed += 1
+            self.unfinished -= 1
+            self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.unfinished <= 0)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            handed = self.captured - self.dropped - len(self.frames)
+            return {"captured": self.captured, "dropped": self.dropped, "processed": self.processed,
+                    "queued": len(self.frames), "mean_wait_ms": self.wait_time / handed * 1e3 if handed else 0.0}
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Frames captured {stats['captured']}, dropped {stats['dropped']}, processed {stats['processed']}, "
+                f"mean queue wait {stats['mean_wait_ms']:.1f} ms")
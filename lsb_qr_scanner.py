@@ -1,88 +1,149 @@
+"""
+Usage:
+  lsb_qr_scanner.py [--input=<image>] [--extracted=<png>]
+  lsb_qr_scanner.py batch <images> [--output=<jsonl>] [--processes=<n>] [--cache=<db> | --no-cache]
+
+Options:
+  -h, --help                Show this help
+  --input=<image>           Carrier holding a QR image in bit plane 0 [default: hidden_qr.png]
+  --extracted=<png>         Where the extracted QR image is saved [default: extracted_qr.png]
+  --output=<jsonl>          Append one JSON line per carrier to this file, - for stdout [default: -]
+  --processes=<n>           Carriers scanned in parallel, 0 uses every core [default: 0]
+  --cache=<db>              Result cache, carriers scanned before aren't decoded again (default: ~/.cache/lsb-steg/results.sqlite)
+  --no-cache                Scan every carrier, without reading or filling the cache
+
+batch scans every image of a directory, or matching a glob, without writing anything but the results.
+"""
+
 import os
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import cv2
+import docopt
 import numpy as np
 from pyzbar.pyzbar import decode
 
-class LSBSteg:
-    def __init__(self, im):
-        self.image = im
-        self.height, self.width, self.nbchannels = im.shape
-        self.size = self.width * self.height
-        
-        self.maskONE = 1  # 00000001
-        self.maskZERO = 254  # 11111110
-        
-        self.curwidth = 0
-        self.curheight = 0
-        self.curchan = 0
-
-    def next_slot(self):
-        if self.curchan == self.nbchannels - 1:
-            self.curchan = 0
-            if self.curwidth == self.width - 1:
-                self.curwidth = 0
-                if self.curheight == self.height - 1:
-                    self.curheight = 0
-                    return False  # No more slots available
-                else:
-                    self.curheight += 1
-            else:
-                self.curwidth += 1
-        else:
-            self.curchan += 1
-        return True
-
-    def read_bit(self):
-        val = self.image[self.curheight, self.curwidth][self.curchan]
-        val = int(val) & self.maskONE
-        self.next_slot()
-        if val > 0:
-            return "1"
-        else:
-            return "0"
-
-    def read_byte(self):
-        return self.read_bits(8)
+from LSBSteg import LSBSteg, SteganographyException, check_header
+from frame_sources import ImageSource
+from result_cache import DEFAULT_PATH, file_stat, open_cache, pixel_key
+from result_sinks import JsonlSink
 
-    def read_bits(self, nb):
-        bits = ""
-        for i in range(nb):
-            bits += self.read_bit()
-        return bits
+CACHE_PARAMS = {"scanner": "lsb_qr_scanner", "planes": 1}  # What a cached result depends on besides the pixels
 
-    def decode_binary(self):
-        l = int(self.read_bits(64), 2)
-        output = b""
-        for i in range(l):
-            output += bytes([int(self.read_byte(), 2)])
-        return output
+def extract_payload(img):
+    if check_header(img, planes=1) is None: # Only bit plane 0 is read
+        raise ValueError("Hidden data length larger than the image capacity")
+    return LSBSteg(img).decode_binary()
 
 def extract_hidden_data(image_path):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Unable to read image at {image_path}")
-    steg = LSBSteg(img)
-    return steg.decode_binary()
+    return extract_payload(img)
+
+def payload_image(data):
+    # Hidden image decoded from the payload bytes in memory, None if they aren't an image
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
 
 def save_extracted_image(data, output_path):
-    nparr = np.frombuffer(data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    cv2.imwrite(output_path, img)
+    cv2.imwrite(output_path, payload_image(data))
 
-def decode_qr(image_path):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Unable to read image at {image_path}")
+def decode_qr_image(img):
     decoded_objects = decode(img)
     for obj in decoded_objects:
         return obj.data.decode('utf-8')
     return None
 
+def decode_qr(image_path):
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"Unable to read image at {image_path}")
+    return decode_qr_image(img)
+
+def scan_image(img, record):
+    # Fills record with the QR text hidden in img, or an error, and the time of each step in ms
+    start = time.perf_counter()
+    try:
+        data = extract_payload(img)
+    except (ValueError, SteganographyException) as e:  # No payload, or a corrupt one (CRC, compressed stream)
+        record["error"] = str(e)
+        return record
+    extracted = time.perf_counter()
+    record["extract_ms"] = round((extracted - start) * 1e3, 3)
+    hidden = payload_image(data)
+    if hidden is None:
+        record["error"] = "payload is not an image"
+        return record
+    record["qr"] = decode_qr_image(hidden)
+    record["qr_ms"] = round((time.perf_counter() - extracted) * 1e3, 3)
+    return record
+
+def scan_carrier(path, cache_path=None):
+    # One batch entry: QR text hidden in the carrier at path, with the time of each step in ms.
+    # With a cache, an unchanged file is answered from its stat and known pixels from their hash.
+    record = {"path": path, "qr": None}
+    cache = open_cache(cache_path) if cache_path else None
+    start = time.perf_counter()
+    if cache:
+        try:
+            stat = file_stat(path)
+        except OSError:
+            record["error"] = "unreadable image"
+            return record
+        cached = cache.lookup_file(path, CACHE_PARAMS, stat)
+        if cached is not None:
+            record.update(cached, cached="file", lookup_ms=round((time.perf_counter() - start) * 1e3, 3))
+            return record
+    img = cv2.imread(path)
+    read = time.perf_counter()
+    record["read_ms"] = round((read - start) * 1e3, 3)
+    if img is None:
+        record["error"] = "unreadable image"
+        return record
+    if cache:
+        key = pixel_key(img, **CACHE_PARAMS)
+        cached = cache.get(key)
+        if cached is not None:
+            cache.link(path, CACHE_PARAMS, stat, key)
+            record.update(cached, cached="pixels", lookup_ms=round((time.perf_counter() - read) * 1e3, 3))
+            return record
+    scan_image(img, record)
+    if cache:
+        cache.put(key, {k: record[k] for k in ("qr", "error") if k in record}, path, CACHE_PARAMS, stat)
+    return record
+
+def scan_batch(paths, sink, processes=None, chunksize=16, cache_path=None):
+    # Scans paths on a process pool, results reach sink in the order of paths as they come
+    found = cached = 0
+    with ProcessPoolExecutor(processes) as executor:
+        for record in executor.map(partial(scan_carrier, cache_path=cache_path), paths, chunksize=chunksize):
+            found += record["qr"] is not None
+            cached += "cached" in record
+            sink(record)
+    if cache_path:
+        open_cache(cache_path).evict()  # Workers only check the size every few puts
+    return found, cached
+
 def main():
-    input_image = 'hidden_qr.png'
-    extracted_image_path = 'extracted_qr.png'
+    args = docopt.docopt(__doc__)
+    if args["batch"]:
+        paths = ImageSource(args["<images>"]).paths
+        start = time.time()
+        cache_path = None if args["--no-cache"] else args["--cache"] or DEFAULT_PATH
+        with JsonlSink(args["--output"]) as sink:
+            found, cached = scan_batch(paths, sink, int(args["--processes"]) or None, cache_path=cache_path)
+        elapsed = time.time() - start
+        print(f"{len(paths)} carriers in {elapsed:.2f} seconds ({len(paths) / elapsed * 60:.0f}/min), "
+              f"{found} with a QR code, {cached} from the cache", file=sys.stderr)
+        return
+
+    input_image = args["--input"]
+    extracted_image_path = args["--extracted"]
 
     if not os.path.exists(input_image):
         print(f"Error: The file {input_image} does not exist in the current directory.")
@@ -97,8 +158,9 @@ def main():
 
         print(f"Extracted image saved as {extracted_image_path}")
 
-        # Decode QR code
-        qr_data = decode_qr(extracted_image_path)
+        # Decode QR code from the image in memory, not from the file just written
+        hidden_image = payload_image(hidden_data)
+        qr_data = decode_qr_image(hidden_image) if hidden_image is not None else None
 
         if qr_data:
             print(f"QR Code content: {qr_data}")
@@ -108,4 +170,4 @@ def main():
         print(f"An error occurred: {str(e)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,3 +1,13 @@
+"""
+Usage:
+  lsb_qr_url_opener.py [--cache=<db> | --no-cache]
+
+Options:
+  -h, --help                Show this help
+  --cache=<db>              Result cache, images scanned before aren't decoded again (default: ~/.cache/lsb-steg/results.sqlite)
+  --no-cache                Always decode the image, without reading or filling the cache
+"""
+
 import os
 import sys
 
@@ -5,6 +15,7 @@ import sys
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
 import cv2
+import docopt
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
@@ -20,70 +31,15 @@ except ImportError as e:
     print("  pip install pyzbar")
     sys.exit(1)
 
-class LSBSteg:
-    def __init__(self, img):
-        self.img = img
-        self.height, self.width, self.nbchannels = img.shape
-        self.size = self.width * self.height
-        
-        self.maskONEValues = [1,2,4,8,16,32,64,128]
-        self.maskONE = self.maskONEValues.pop(0)
-        
-        self.maskZEROValues = [254,253,251,247,239,223,191,127]
-        self.maskZERO = self.maskZEROValues.pop(0)
-        
-        self.curwidth = 0
-        self.curheight = 0
-        self.curchan = 0
-
-    def next_slot(self):
-        if self.curchan == self.nbchannels-1:
-            self.curchan = 0
-            if self.curwidth == self.width-1:
-                self.curwidth = 0
-                if self.curheight == self.height-1:
-                    self.curheight = 0
-                    if self.maskONE == 128:
-                        return None
-                    else:
-                        self.maskONE = self.maskONEValues.pop(0)
-                        self.maskZERO = self.maskZEROValues.pop(0)
-                else:
-                    self.curheight += 1
-            else:
-                self.curwidth += 1
-        else:
-            self.curchan += 1
-        return True
-
-    def read_bit(self):
-        val = self.img[self.curheight,self.curwidth][self.curchan]
-        val = int(val) & self.maskONE
-        self.next_slot()
-        if val > 0:
-            return "1"
-        else:
-            return "0"
-    
-    def read_byte(self):
-        return self.read_bits(8)
-    
-    def read_bits(self, nb):
-        bits = ""
-        for i in range(nb):
-            bits += self.read_bit()
-        return bits
-
-    def decode_binary(self):
-        l = int(self.read_bits(64), 2)
-        output = b""
-        for i in range(l):
-            output += bytes([int(self.read_byte(), 2)])
-        return output
+from LSBSteg import LSBSteg, SteganographyException, check_header
+from result_cache import DEFAULT_PATH, ResultCache, file_stat, pixel_key
+
+CACHE_PARAMS = {"scanner": "lsb_qr_url_opener", "planes": 8}  # What a cached result depends on besides the pixels
 
 def extract_lsb_data(img):
-    steg = LSBSteg(img)
-    return steg.decode_binary()
+    if check_header(img) is None:
+        return None  # Length header doesn't fit in the image
+    return LSBSteg(img).decode_binary()
 
 def find_and_decode_qr(data):
     if data is None:
@@ -103,26 +59,41 @@ def find_and_decode_qr(data):
     
     return None
 
-def process_image(file_path):
-    # Read the image
-    img = cv2.imread(file_path)
-    if img is None:
-        print("Error: Unable to read the image.")
-        return None
-
-    # Extract LSB data
-    extracted_data = extract_lsb_data(img)
+def scan_image(img):
+    # QR text hidden in img, or None and the reason it couldn't be found
+    try:
+        extracted_data = extract_lsb_data(img)
+    except SteganographyException as e:  # Corrupt payload: CRC mismatch or broken compressed stream
+        return None, f"Failed to extract LSB data: {e}"
     if extracted_data is None:
-        print("Error: Failed to extract LSB data.")
-        return None
-
-    # Decode QR code
+        return None, "Failed to extract LSB data."
     qr_data = find_and_decode_qr(extracted_data)
     if qr_data is None:
-        print("Error: No QR code found in the extracted data.")
-        return None
-
-    return qr_data
+        return None, "No QR code found in the extracted data."
+    return qr_data, None
+
+def process_image(file_path, cache=None):
+    # With a cache, an unchanged file is answered from its stat and known pixels from their hash
+    stat = file_stat(file_path) if cache and os.path.exists(file_path) else None
+    result = cache.lookup_file(file_path, CACHE_PARAMS, stat) if stat else None
+    if result is None:
+        # Read the image
+        img = cv2.imread(file_path)
+        if img is None:
+            print("Error: Unable to read the image.")
+            return None
+
+        key = pixel_key(img, **CACHE_PARAMS) if stat else None
+        result = cache.get(key) if key else None
+        if result is None:
+            qr_data, error = scan_image(img)
+            result = {"qr": qr_data, "error": error}
+        if key:
+            cache.put(key, result, file_path, CACHE_PARAMS, stat)
+
+    if result.get("error"):
+        print(f"Error: {result['error']}")
+    return result["qr"]
 
 def open_file_dialog():
     root = tk.Tk()
@@ -131,6 +102,7 @@ def open_file_dialog():
     return file_path
 
 def main():
+    args = docopt.docopt(__doc__)
     print("Please select an image file containing the hidden QR code.")
     file_path = open_file_dialog()
     
@@ -139,7 +111,11 @@ def main():
         return
 
     print(f"Processing image: {file_path}")
-    qr_content = process_image(file_path)
+    if args["--no-cache"]:
+        qr_content = process_image(file_path)
+    else:
+        with ResultCache(args["--cache"] or DEFAULT_PATH) as cache:
+            qr_content = process_image(file_path, cache)
 
     if qr_content:
         print(f"QR Code content: {qr_content}")
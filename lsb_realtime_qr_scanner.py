@@ -1,162 +1,142 @@
+"""
+Usage:
+  lsb_realtime_qr_scanner.py [--source=<src>] [--headless] [--output=<jsonl>]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --headless                No windows and no per-frame output, results go to --output (stdout by default)
+  --output=<jsonl>          Append results to this JSON Lines file, - for stdout
+"""
+
 import os
+import sys
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
 import cv2
+import docopt
 import numpy as np
 from pyzbar.pyzbar import decode
 import time
-import signal
-
-class LSBSteg:
-    def __init__(self, im):
-        self.image = im
-        self.height, self.width, self.nbchannels = im.shape
-        self.size = self.width * self.height
-        
-        self.maskONE = 1
-        self.maskZERO = 254
-        
-        self.curwidth = 0
-        self.curheight = 0
-        self.curchan = 0
-
-    def next_slot(self):
-        if self.curchan == self.nbchannels - 1:
-            self.curchan = 0
-            if self.curwidth == self.width - 1:
-                self.curwidth = 0
-                if self.curheight == self.height - 1:
-                    self.curheight = 0
-                    return False
-                else:
-                    self.curheight += 1
-            else:
-                self.curwidth += 1
-        else:
-            self.curchan += 1
-        return True
-
-    def read_bit(self):
-        val = self.image[self.curheight, self.curwidth][self.curchan]
-        val = int(val) & self.maskONE
-        self.next_slot()
-        if val > 0:
-            return "1"
-        else:
-            return "0"
-
-    def read_byte(self):
-        return self.read_bits(8)
-
-    def read_bits(self, nb):
-        bits = ""
-        for i in range(nb):
-            bits += self.read_bit()
-        return bits
-
-    def decode_binary(self):
-        l = int(self.read_bits(64), 2)
-        output = b""
-        for i in range(l):
-            output += bytes([int(self.read_byte(), 2)])
-        return output
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Function call timed out")
-
-def extract_hidden_data(image, timeout=5):
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(timeout)
-    
+from contextlib import nullcontext
+
+from LSBSteg import LSBSteg, SteganographyException, check_header
+from frame_sources import open_source
+from result_sinks import open_sink, status_printer
+
+def extract_hidden_data(image, budget_ms=5000, verbose=True):
+    if check_header(image, planes=1) is None:
+        return None  # Length header is noise, or more than bit plane 0 holds
     try:
-        steg = LSBSteg(image)
-        result = steg.decode_binary()
-        signal.alarm(0)  # Cancel the alarm
-        return result
-    except TimeoutError:
-        print("LSB extraction timed out")
+        data, complete = LSBSteg(image).decode_budgeted(budget_ms, max_bytes=image.nbytes)  # A hidden QR image is never bigger than its frame
+    except SteganographyException as e:  # Corrupt payload
+        if verbose:
+            print(f"LSB extraction failed: {e}")
+        return None
+    if not complete:
+        if verbose:
+            print(f"LSB extraction stopped after {budget_ms} ms ({len(data)} bytes read)")
         return None
+    return data
 
-def scan_lsb_qr_from_camera():
-    print("Initializing camera...")
-    cap = cv2.VideoCapture(0)
+def scan_lsb_qr_from_camera(source=0, headless=False, sink=None):
+    # headless drops the windows and the per-frame output; every code found also goes to sink
+    verbose = not headless
+    log = status_printer(headless)
+    log("Initializing camera...")
+    cap = open_source(source)
 
     if not cap.isOpened():
         raise IOError("Cannot open webcam")
 
-    print("Camera initialized successfully.")
+    log("Camera initialized successfully.")
     
     last_scan_time = 0
     scan_interval = 1  # Minimum time (in seconds) between scans
 
-    print("LSB QR Code Scanner is running. Press 'q' to quit.")
+    log("LSB QR Code Scanner is running. Press " + ("Ctrl+C" if headless else "'q'") + " to quit.")
 
     frame_count = 0
-    while True:
-        print(f"Reading frame {frame_count}...")
-        ret, frame = cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            break
-
-        frame_count += 1
-        print(f"Processing frame {frame_count}...")
-
-        # Display the original frame immediately
-        cv2.imshow('Original Frame', frame)
-        print("Displayed original frame.")
-
-        try:
-            # Extract hidden data using LSB with a timeout
-            hidden_data = extract_hidden_data(frame, timeout=2)
-
-            if hidden_data is not None:
-                # Convert hidden data to image
-                nparr = np.frombuffer(hidden_data, np.uint8)
-                hidden_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-                if hidden_image is not None:
-                    print("Hidden image extracted successfully.")
-                    # Try to decode QR codes in the hidden image
-                    decoded_objects = decode(hidden_image)
-
-                    current_time = time.time()
-
-                    for obj in decoded_objects:
-                        # If enough time has passed since the last scan, print the data
-                        if current_time - last_scan_time > scan_interval:
+    try:
+        while True:
+            if verbose:
+                log(f"Reading frame {frame_count}...")
+            ret, frame = cap.read()
+            if not ret:
+                log("Failed to grab frame")
+                break
+
+            frame_count += 1
+            if verbose:
+                log(f"Processing frame {frame_count}...")
+
+                # Display the original frame immediately
+                cv2.imshow('Original Frame', frame)
+                log("Displayed original frame.")
+
+            try:
+                # Extract hidden data using LSB within a time budget
+                hidden_data = extract_hidden_data(frame, budget_ms=2000, verbose=verbose)
+
+                if hidden_data is not None:
+                    # Convert hidden data to image
+                    nparr = np.frombuffer(hidden_data, np.uint8)
+                    hidden_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+                    if hidden_image is not None:
+                        if verbose:
+                            log("Hidden image extracted successfully.")
+                        # Try to decode QR codes in the hidden image
+                        decoded_objects = decode(hidden_image)
+
+                        current_time = time.time()
+
+                        for obj in decoded_objects:
                             qr_data = obj.data.decode('utf-8')
-                            print(f"LSB QR Code detected: {qr_data}")
-                            last_scan_time = current_time
-
-                    # Display the hidden image (optional)
-                    cv2.imshow('Hidden Image', hidden_image)
-                    print("Displayed hidden image.")
-                else:
-                    print("Failed to decode hidden image")
-            else:
-                print("No hidden data extracted")
-
-        except Exception as e:
-            print(f"Error processing frame: {str(e)}")
-
-        # Check for 'q' key to quit
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            print("Quit key pressed. Exiting...")
-            break
-        elif key != 255:
-            print(f"Key pressed: {key}")
-
-    print("Releasing camera and closing windows...")
+                            if sink:
+                                sink({"frame": frame_count, "content": qr_data})
+                            # If enough time has passed since the last scan, print the data
+                            if verbose and current_time - last_scan_time > scan_interval:
+                                log(f"LSB QR Code detected: {qr_data}")
+                                last_scan_time = current_time
+
+                        if verbose:
+                            # Display the hidden image (optional)
+                            cv2.imshow('Hidden Image', hidden_image)
+                            log("Displayed hidden image.")
+                    elif verbose:
+                        log("Failed to decode hidden image")
+                elif verbose:
+                    log("No hidden data extracted")
+
+            except Exception as e:
+                log(f"Error processing frame: {str(e)}")
+
+            if headless:
+                continue
+
+            # Check for 'q' key to quit
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                log("Quit key pressed. Exiting...")
+                break
+            elif key != 255:
+                log(f"Key pressed: {key}")
+    except KeyboardInterrupt:
+        log("Interrupted.")
+
+    log("Releasing camera and closing windows...")
     cap.release()
-    cv2.destroyAllWindows()
-    print("Camera released and windows closed.")
+    if not headless:
+        cv2.destroyAllWindows()
+    log("Camera released and windows closed.")
 
 if __name__ == "__main__":
     try:
-        scan_lsb_qr_from_camera()
+        args = docopt.docopt(__doc__)
+        with open_sink(args) or nullcontext() as sink:
+            scan_lsb_qr_from_camera(args["--source"], args["--headless"], sink)
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        print(f"An error occurred: {str(e)}", file=sys.stderr)
     finally:
-        print("Script execution completed.")
\ No newline at end of file
+        print("Script execution completed.", file=sys.stderr)
\ No newline at end of file
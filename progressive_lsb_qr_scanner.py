@@ -1,3 +1,17 @@
+"""
+Usage:
+  progressive_lsb_qr_scanner.py [--source=<src>] [--queue=<n>] [--queue-policy=<p>] [--headless] [--output=<jsonl>]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --queue=<n>               Frames buffered between capture and the worker [default: 1]
+  --queue-policy=<p>        When the buffer is full: block until the worker catches up, drop-oldest, or latest to keep
+                            only the newest frame. Cameras default to drop-oldest, other sources to block
+  --headless                No windows and no per-frame output, results go to --output (stdout by default)
+  --output=<jsonl>          Append results to this JSON Lines file, - for stdout
+"""
+
 import os
 import sys
 
@@ -5,10 +19,11 @@ import sys
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
 import cv2
+import docopt
 import numpy as np
 import time
 from queue import Queue
-from threading import Thread, Timer
+from threading import Thread
 
 try:
     from pyzbar.pyzbar import decode
@@ -20,96 +35,33 @@ except ImportError as e:
     print("  pip install pyzbar")
     sys.exit(1)
 
-class TimeoutException(Exception):
-    pass
-
-class LSBSteg:
-    def __init__(self, img):
-        self.img = img
-        self.height, self.width, self.nbchannels = img.shape
-        self.size = self.width * self.height
-        
-        self.maskONEValues = [1,2,4,8,16,32,64,128]
-        self.maskONE = self.maskONEValues.pop(0)
-        
-        self.maskZEROValues = [254,253,251,247,239,223,191,127]
-        self.maskZERO = self.maskZEROValues.pop(0)
-        
-        self.curwidth = 0
-        self.curheight = 0
-        self.curchan = 0
-
-    def next_slot(self):
-        if self.curchan == self.nbchannels-1:
-            self.curchan = 0
-            if self.curwidth == self.width-1:
-                self.curwidth = 0
-                if self.curheight == self.height-1:
-                    self.curheight = 0
-                    if self.maskONE == 128:
-                        return None
-                    else:
-                        self.maskONE = self.maskONEValues.pop(0)
-                        self.maskZERO = self.maskZEROValues.pop(0)
-                else:
-                    self.curheight += 1
-            else:
-                self.curwidth += 1
-        else:
-            self.curchan += 1
-        return True
-
-    def read_bit(self):
-        val = self.img[self.curheight,self.curwidth][self.curchan]
-        val = int(val) & self.maskONE
-        self.next_slot()
-        if val > 0:
-            return "1"
-        else:
-            return "0"
-    
-    def read_byte(self):
-        return self.read_bits(8)
-    
-    def read_bits(self, nb):
-        return ''.join(self.read_bit() for _ in range(nb))
+from LSBSteg import LSBSteg, SteganographyException, check_header
+from frame_sources import FrameQueue, default_policy, open_source
+from result_sinks import open_sink, status_printer
 
-    def decode_binary(self):
-        start_time = time.time()
-        l = int(self.read_bits(64), 2)
-        output = bytearray()
-        for i in range(l):
-            output.extend(bytes([int(self.read_byte(), 2)]))
-            if i % 100 == 0:  # Log progress every 100 bytes
-                elapsed = time.time() - start_time
-                print(f"Decoded {i}/{l} bytes in {elapsed:.2f} seconds")
-        return bytes(output)
-
-def extract_lsb_data(img, timeout=10):  # Increased timeout to 10 seconds
-    result = [None]
-    def extract():
-        try:
-            start_time = time.time()
-            steg = LSBSteg(img)
-            result[0] = steg.decode_binary()
-            elapsed = time.time() - start_time
-            print(f"LSB extraction completed in {elapsed:.2f} seconds")
-        except Exception as e:
-            print(f"Error in LSB extraction: {e}")
-
-    timer = Timer(timeout, lambda: result.append(TimeoutException("LSB extraction timed out")))
-    timer.start()
-    extract_thread = Thread(target=extract)
-    extract_thread.start()
-    extract_thread.join(timeout)
-    timer.cancel()
-
-    if len(result) > 1:
-        print(f"LSB extraction timed out after {timeout} seconds")
+def extract_lsb_data(img, budget_ms=10000, verbose=True):
+    # Runs in the calling thread; gives up past budget_ms or on a length header the frame can't hold
+    if check_header(img) is None:
+        if verbose:
+            print("No hidden data, length header larger than the frame")
         return None
-    return result[0]
+    start_time = time.time()
+    try:
+        data, complete = LSBSteg(img).decode_budgeted(budget_ms, max_bytes=img.nbytes)  # A hidden QR image is never bigger than its frame
+    except SteganographyException as e:  # Corrupt payload, the worker moves on to the next frame
+        if verbose:
+            print(f"LSB extraction failed: {e}")
+        return None
+    elapsed = time.time() - start_time
+    if not complete:
+        if verbose:
+            print(f"LSB extraction stopped after {budget_ms} ms ({len(data)} bytes read)")
+        return None
+    if verbose:
+        print(f"LSB extraction completed in {elapsed:.2f} seconds")
+    return data
 
-def find_and_decode_qr(data):
+def find_and_decode_qr(data, verbose=True):
     if data is None:
         return None
     start_time = time.time()
@@ -123,46 +75,61 @@ def find_and_decode_qr(data):
         decoded_objects = decode(img)
         for obj in decoded_objects:
             elapsed = time.time() - start_time
-            print(f"QR code decoded in {elapsed:.2f} seconds")
+            if verbose:
+                print(f"QR code decoded in {elapsed:.2f} seconds")
             return obj.data.decode('utf-8')
     except Exception as e:
-        print(f"Error decoding QR code: {e}")
+        if verbose:
+            print(f"Error decoding QR code: {e}")
     
     return None
 
-def process_frame(frame_queue, result_queue):
+def process_frame(frame_queue, result_queue, sink=None, verbose=True):
+    # result_queue (if any) gets the QR content of every frame, None when nothing was found,
+    # sink a record of every QR found
     while True:
         frame = frame_queue.get()
         if frame is None:
             break
         start_time = time.time()
-        extracted_data = extract_lsb_data(frame)
-        qr_data = find_and_decode_qr(extracted_data)
+        extracted_data = extract_lsb_data(frame, verbose=verbose)
+        qr_data = find_and_decode_qr(extracted_data, verbose)
         elapsed = time.time() - start_time
-        print(f"Frame processed in {elapsed:.2f} seconds")
-        result_queue.put(qr_data)
+        if verbose:
+            print(f"Frame processed in {elapsed:.2f} seconds")
+        if qr_data and sink:
+            sink({"content": qr_data})
+        if result_queue is not None:
+            result_queue.put(qr_data)
         frame_queue.task_done()
 
 def main():
-    print("Initializing camera...")
-    cap = cv2.VideoCapture(0)
+    args = docopt.docopt(__doc__)
+    headless = args["--headless"]
+    log = status_printer(headless)
+
+    log("Initializing camera...")
+    cap = open_source(args["--source"])
     
     if not cap.isOpened():
-        print("Error: Could not open camera.")
+        log("Error: Could not open camera.")
         return
 
-    print("Camera initialized successfully.")
-    print("Full LSB QR Code Scanner is running. Press 'q' to quit.")
+    log("Camera initialized successfully.")
+    if headless:
+        log("Full LSB QR Code Scanner is running headless. Press Ctrl+C to quit.")
+    else:
+        log("Full LSB QR Code Scanner is running. Press 'q' to quit.")
+        # Create a named window
+        cv2.namedWindow('Full LSB QR Scanner', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('Full LSB QR Scanner', 640, 480)
 
-    # Create a named window
-    cv2.namedWindow('Full LSB QR Scanner', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('Full LSB QR Scanner', 640, 480)
-
-    frame_queue = Queue(maxsize=30)
-    result_queue = Queue()
+    frame_queue = FrameQueue(int(args["--queue"]), args["--queue-policy"] or default_policy(args["--source"]))
+    result_queue = None if headless else Queue()
+    sink = open_sink(args)
 
     # Start worker thread
-    worker = Thread(target=process_frame, args=(frame_queue, result_queue))
+    worker = Thread(target=process_frame, args=(frame_queue, result_queue, sink, not headless))
     worker.start()
 
     frame_count = 0
@@ -170,46 +137,54 @@ def main():
     last_qr_time = 0
     qr_cooldown = 2  # seconds
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            break
-
-        frame_count += 1
-        current_time = time.time()
-        
-        if frame_count % 30 == 0:
-            elapsed_time = current_time - start_time
-            fps = frame_count / elapsed_time
-            print(f"FPS: {fps:.2f}")
-
-        # Add frame to queue for processing
-        if not frame_queue.full():
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                log("Failed to grab frame")
+                break
+
+            frame_count += 1
+            current_time = time.time()
+            
+            if frame_count % 30 == 0:
+                elapsed_time = current_time - start_time
+                fps = frame_count / elapsed_time
+                log(f"FPS: {fps:.2f}")
+
+            # Add frame to queue for processing, dropping old ones if the worker lags
             frame_queue.put(frame)
-
-        # Check for QR code results
-        if not result_queue.empty() and current_time - last_qr_time > qr_cooldown:
-            qr_data = result_queue.get()
-            if qr_data:
-                print(f"QR Code content: {qr_data}")
-                cv2.putText(frame, f"QR: {qr_data}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                last_qr_time = current_time
-
-        # Display the frame
-        cv2.imshow('Full LSB QR Scanner', frame)
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            print("Quit key pressed.")
-            break
+            if headless:
+                continue
+
+            # Check for QR code results
+            if not result_queue.empty() and current_time - last_qr_time > qr_cooldown:
+                qr_data = result_queue.get()
+                if qr_data:
+                    log(f"QR Code content: {qr_data}")
+                    cv2.putText(frame, f"QR: {qr_data}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                    last_qr_time = current_time
+
+            # Display the frame
+            cv2.imshow('Full LSB QR Scanner', frame)
+
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                log("Quit key pressed.")
+                break
+    except KeyboardInterrupt:
+        log("Interrupted.")
 
     # Clean up
-    frame_queue.put(None)  # Signal the worker thread to exit
+    frame_queue.close()  # The worker exits once the queued frames are done
     worker.join()
+    log(frame_queue.summary())
+    if sink:
+        sink.close()
     cap.release()
-    cv2.destroyAllWindows()
-    print("Camera released and windows closed.")
+    if not headless:
+        cv2.destroyAllWindows()
+    log("Camera released and windows closed.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
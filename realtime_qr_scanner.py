@@ -1,13 +1,33 @@
+"""
+Usage:
+  realtime_qr_scanner.py [--source=<src>] [--headless] [--output=<jsonl>]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --headless                No windows and no per-frame output, results go to --output (stdout by default)
+  --output=<jsonl>          Append results to this JSON Lines file, - for stdout
+"""
+
 import os
+import sys
 os.environ['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib'
 
 import cv2
-from pyzbar.pyzbar import decode
+import docopt
+import numpy as np
 import time
+from contextlib import nullcontext
+
+from enhanced_qr import RoiTracker
+from frame_sources import open_source
+from result_sinks import open_sink, status_printer
 
-def scan_qr_from_camera():
+def scan_qr_from_camera(source=0, headless=False, sink=None):
+    # headless drops the window and the printed codes; every code found also goes to sink
+    log = status_printer(headless)
     # Initialize the camera
-    cap = cv2.VideoCapture(0)  # 0 is usually the default camera
+    cap = open_source(source)  # Camera index, video file, images or synthetic frames
 
     if not cap.isOpened():
         raise IOError("Cannot open webcam")
@@ -15,47 +35,63 @@ def scan_qr_from_camera():
     last_scan_time = 0
     scan_interval = 1  # Minimum time (in seconds) between scans
 
-    print("QR Code Scanner is running. Press 'q' to quit.")
+    tracker = RoiTracker()  # Decodes around the last code seen instead of the full frame
+
+    log("QR Code Scanner is running. Press " + ("Ctrl+C" if headless else "'q'") + " to quit.")
+
+    frame_count = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                log("Failed to grab frame")
+                break
+            frame_count += 1
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            break
+            # Try to decode QR codes in the frame
+            decoded_objects = tracker.decode(frame)
 
-        # Try to decode QR codes in the frame
-        decoded_objects = decode(frame)
+            if sink:
+                for obj in decoded_objects:
+                    sink({"frame": frame_count, "content": obj.data.decode('utf-8'), "rect": list(obj.rect)})
+            if headless:
+                continue
 
-        current_time = time.time()
+            current_time = time.time()
 
-        for obj in decoded_objects:
-            # Draw a rectangle around the QR code
-            points = obj.polygon
-            if len(points) > 4:
-                hull = cv2.convexHull(np.array([point for point in points], dtype=np.float32))
-                cv2.polylines(frame, [hull], True, (0, 255, 0), 2)
-            else:
-                cv2.polylines(frame, [np.array(points, dtype=np.int32)], True, (0, 255, 0), 2)
+            for obj in decoded_objects:
+                # Draw a rectangle around the QR code
+                points = obj.polygon
+                if len(points) > 4:
+                    hull = cv2.convexHull(np.array([point for point in points], dtype=np.float32))
+                    cv2.polylines(frame, [hull], True, (0, 255, 0), 2)
+                else:
+                    cv2.polylines(frame, [np.array(points, dtype=np.int32)], True, (0, 255, 0), 2)
 
-            # If enough time has passed since the last scan, print the data
-            if current_time - last_scan_time > scan_interval:
-                qr_data = obj.data.decode('utf-8')
-                print(f"QR Code detected: {qr_data}")
-                last_scan_time = current_time
+                # If enough time has passed since the last scan, print the data
+                if current_time - last_scan_time > scan_interval:
+                    qr_data = obj.data.decode('utf-8')
+                    log(f"QR Code detected: {qr_data}")
+                    last_scan_time = current_time
 
-        # Display the frame
-        cv2.imshow('QR Code Scanner', frame)
+            # Display the frame
+            cv2.imshow('QR Code Scanner', frame)
 
-        # Check for 'q' key to quit
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+            # Check for 'q' key to quit
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        log("Interrupted.")
 
     # Release the camera and close windows
     cap.release()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     try:
-        scan_qr_from_camera()
+        args = docopt.docopt(__doc__)
+        with open_sink(args) or nullcontext() as sink:
+            scan_qr_from_camera(args["--source"], args["--headless"], sink)
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
\ No newline at end of file
+        print(f"An error occurred: {str(e)}", file=sys.stderr)
\ No newline at end of file
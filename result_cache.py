@@ -0,0 +1,109 @@
+# On-disk cache of scan results, so carriers scanned again (retries, re-crawls)
+# skip the LSB extraction and the QR decoding. Results are keyed by a hash of
+# the carrier's pixels plus the scanner's codec parameters, so a carrier copied
+# or re-saved losslessly still hits. A second table maps a file's path and the
+# codec parameters to its (size, mtime, inode): while those are unchanged a
+# lookup returns the result from a stat, without reading the image. Entries
+# are evicted least recently used first once the cache is over max_bytes.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from functools import lru_cache
+
+DEFAULT_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                            "lsb-steg", "results.sqlite")
+CACHE_VERSION = 1  # Part of every key, bump it when a scanner's results change meaning
+EVICT_EVERY = 64  # Puts between two size checks, the sum is a full scan of the table
+SCHEMA_VERSION = 2  # Older files tables, keyed by path only, are dropped on open
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE TABLE IF NOT EXISTS files (path TEXT NOT NULL, params TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+                                  inode INTEGER NOT NULL, key TEXT NOT NULL, PRIMARY KEY (path, params));
+"""
+
+def params_key(params):  # Digest of the codec parameters, two scanners reading the same file don't share its results
+    return hashlib.blake2b(json.dumps([CACHE_VERSION, params], sort_keys=True).encode(), digest_size=8).hexdigest()
+
+def pixel_key(img, **params):
+    # Hash of the pixel buffer, its shape and the codec parameters the result depends on
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([CACHE_VERSION, img.shape, str(img.dtype), params], sort_keys=True).encode())
+    h.update(memoryview(img if img.flags.c_contiguous else img.copy()).cast("B"))
+    return h.hexdigest()
+
+def file_stat(path):  # What the fast path compares, any change means the file must be read again
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=32 << 20):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)  # Autocommit, batch workers share the file
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS files")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.executescript(SCHEMA)
+        self.puts = 0
+
+    def get(self, key):  # Cached result for a pixel key, None on a miss
+        row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def lookup_file(self, path, params, stat=None):
+        # Cached result of the file at path for these codec parameters, if it is unchanged since it was scanned
+        row = self.db.execute("SELECT size, mtime_ns, inode, key FROM files WHERE path = ? AND params = ?",
+                              (path, params_key(params))).fetchone()
+        if row is None or tuple(row[:3]) != (stat or file_stat(path)):
+            return None
+        return self.get(row[3])
+
+    def link(self, path, params, stat, key):  # Let the fast path find key from path and params while the file keeps stat
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", (path, params_key(params), *stat, key))
+
+    def put(self, key, value, path=None, params=None, stat=None):  # With path, also link it for the params the key was made with
+        text = json.dumps(value)
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                        (key, text, len(key) + len(text), time.time()))
+        if path is not None:
+            self.link(path, params, stat or file_stat(path), key)
+        self.puts += 1
+        if self.puts % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):  # Drop least recently used results until the cache is back under max_bytes
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess, cutoff = total - self.max_bytes, None
+        for size, used in self.db.execute("SELECT size, used FROM results ORDER BY used"):
+            excess -= size
+            cutoff = used
+            if excess <= 0:
+                break
+        self.db.execute("DELETE FROM results WHERE used <= ?", (cutoff,))
+        self.db.execute("DELETE FROM files WHERE key NOT IN (SELECT key FROM results)")
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@lru_cache(maxsize=None)
+def open_cache(path=DEFAULT_PATH):  # One connection per process and path, for pool workers
+    return ResultCache(path)
@@ -0,0 +1,36 @@
+# Where the scanners report what they find. A sink is any callable taking one
+# result dict, so a caller can pass its own function; JsonlSink appends every
+# result as one JSON line to a file, or to stdout with "-".
+
+import json
+import sys
+import time
+from functools import partial
+
+class JsonlSink:
+    def __init__(self, path="-"):
+        self.file = sys.stdout if path == "-" else open(path, "a")
+
+    def __call__(self, record):
+        self.file.write(json.dumps(dict(record, time=round(time.time(), 3))) + "\n")
+        self.file.flush()  # Results are rare, a reader tailing the file sees them at once
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def status_printer(headless):
+    # print for a scanner's status lines: stderr when headless, so stdout only carries the JSONL results
+    return partial(print, file=sys.stderr) if headless else print
+
+def open_sink(args):
+    # JsonlSink for the --headless and --output options of a scanner, None when results are only shown
+    if args["--output"] or args["--headless"]:
+        return JsonlSink(args["--output"] or "-")
+    return None
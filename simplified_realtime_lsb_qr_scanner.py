@@ -1,6 +1,22 @@
+"""
+Usage:
+  simplified_realtime_lsb_qr_scanner.py [--source=<src>] [--processes=<n>] [--queue=<n>] [--queue-policy=<p>] [--headless] [--output=<jsonl>]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --processes=<n>           Processes decoding the planes of a frame, 0 uses every core, 1 decodes in the scan thread [default: 0]
+  --queue=<n>               Frames buffered between capture and the worker [default: 1]
+  --queue-policy=<p>        When the buffer is full: block until the worker catches up, drop-oldest, or latest to keep
+                            only the newest frame. Cameras default to drop-oldest, other sources to block
+  --headless                No windows and no per-frame output, results go to --output (stdout by default)
+  --output=<jsonl>          Append results to this JSON Lines file, - for stdout
+"""
+
 import os
 import sys
 import cv2
+import docopt
 import numpy as np
 import time
 from threading import Thread, Event
@@ -19,6 +35,10 @@ except ImportError as e:
     print("  pip install pyzbar")
     sys.exit(1)
 
+from enhanced_qr import HintCache, PlanePool, search_frame
+from frame_sources import FrameQueue, default_policy, open_source
+from result_sinks import open_sink, status_printer
+
 def expand_shortened_url(identifier):
     return f"https://your-actual-domain.com/{identifier}"
 
@@ -48,62 +68,73 @@ def find_and_decode_qr(img):
         print(f"Error decoding QR code: {e}")
     return None
 
-def process_frame(frame_queue, result_queue, stop_event):
+def process_frame(frame_queue, result_queue, stop_event, pool, sink=None, verbose=True):
+    # result_queue gets the first code of each frame for display, sink a record of it
+    hints = HintCache()
+    frame_index = 0
     while not stop_event.is_set():
         try:
             frame = frame_queue.get(timeout=1)
             start_time = time.time()
             
-            for bit_plane in range(4):  # Check first 4 bit planes
+            # First 4 bit planes: the last hit ones, then the most QR-like if they miss
+            found, decoded = search_frame(frame, pool, hints, frame_index, max_plane=4)
+            frame_index += 1
+            if found and sink:
+                raw_content, bit_plane, channel = found[0]
+                sink({"content": raw_content, "bit_plane": bit_plane, "channel": channel})
+            if not verbose:
+                frame_queue.task_done()
+                continue
+            if found:
+                raw_content, bit_plane, channel = found[0]
+                qr_data = decode_qr_content(raw_content)
                 lsb_frame = extract_lsb(frame, bit_plane)
-                
-                # Try each channel separately
-                for channel in range(3):
-                    qr_data = find_and_decode_qr(lsb_frame[:,:,channel])
-                    if qr_data:
-                        print(f"QR Code detected in bit plane {bit_plane}, channel {channel}")
-                        print(f"Content: {qr_data}")
-                        result_queue.put((qr_data, lsb_frame, bit_plane, channel))
-                        return
-                
-                # Try all channels combined
-                qr_data = find_and_decode_qr(lsb_frame)
-                if qr_data:
-                    print(f"QR Code detected in bit plane {bit_plane}, all channels")
-                    print(f"Content: {qr_data}")
-                    result_queue.put((qr_data, lsb_frame, bit_plane, -1))
-                    return
-            
-            print("No hidden QR Code detected in this frame")
+                print(f"QR Code detected in bit plane {bit_plane}, channel {channel}")
+                print(f"Content: {qr_data}")
+                if result_queue is not None:
+                    result_queue.put((qr_data, lsb_frame, bit_plane, channel))
+            else:
+                print("No hidden QR Code detected in this frame")
             
             elapsed = time.time() - start_time
-            print(f"Frame processed in {elapsed:.2f} seconds")
+            print(f"Frame processed in {elapsed:.2f} seconds ({decoded} planes decoded)")
             
             frame_queue.task_done()
         except Empty:
             continue
         except Exception as e:
-            print(f"Error in process_frame: {e}")
+            print(f"Error in process_frame: {e}", file=sys.stderr)
+            frame_queue.task_done()
 
 def main():
-    print("Initializing camera...")
-    cap = cv2.VideoCapture(0)
+    args = docopt.docopt(__doc__)
+    processes = int(args["--processes"]) or None
+    headless = args["--headless"]
+    log = status_printer(headless)
+
+    log("Initializing camera...")
+    cap = open_source(args["--source"])
     
     if not cap.isOpened():
-        print("Error: Could not open camera.")
+        log("Error: Could not open camera.")
         return
 
-    print("Camera initialized successfully.")
-    print("LSB Hidden QR Code Detector is running. Press 'q' to quit.")
+    log("Camera initialized successfully.")
+    if headless:
+        log("LSB Hidden QR Code Detector is running headless. Press Ctrl+C to quit.")
+    else:
+        log("LSB Hidden QR Code Detector is running. Press 'q' to quit.")
+        cv2.namedWindow('LSB QR Scanner', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('LSB QR Scanner', 640, 480)
 
-    cv2.namedWindow('LSB QR Scanner', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('LSB QR Scanner', 640, 480)
-
-    frame_queue = Queue(maxsize=1)
-    result_queue = Queue()
+    frame_queue = FrameQueue(int(args["--queue"]), args["--queue-policy"] or default_policy(args["--source"]))
+    result_queue = None if headless else Queue()
     stop_event = Event()
+    pool = PlanePool(processes)
+    sink = open_sink(args)
 
-    worker = Thread(target=process_frame, args=(frame_queue, result_queue, stop_event))
+    worker = Thread(target=process_frame, args=(frame_queue, result_queue, stop_event, pool, sink, not headless))
     worker.start()
 
     last_qr_time = 0
@@ -115,7 +146,7 @@ def main():
         while True:
             ret, frame = cap.read()
             if not ret:
-                print("Failed to grab frame")
+                log("Failed to grab frame")
                 break
 
             frame_count += 1
@@ -123,19 +154,22 @@ def main():
             
             if frame_count % 30 == 0:  # Print FPS every 30 frames
                 fps = frame_count / (current_time - start_time)
-                print(f"FPS: {fps:.2f}")
+                log(f"FPS: {fps:.2f}")
                 frame_count = 0
                 start_time = current_time
 
+            if headless:
+                frame_queue.put(frame)
+                continue
+
             cv2.putText(frame, "Scanning for hidden QR...", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
-            if frame_queue.empty():
-                frame_queue.put(frame)
+            frame_queue.put(frame)
 
             if not result_queue.empty():
                 qr_data, lsb_frame, bit_plane, channel = result_queue.get()
                 if current_time - last_qr_time > qr_cooldown:
-                    print(f"Hidden QR Code content: {qr_data}")
+                    log(f"Hidden QR Code content: {qr_data}")
                     display_frame = cv2.cvtColor(lsb_frame, cv2.COLOR_BGR2GRAY) if channel != -1 else lsb_frame
                     display_frame = cv2.cvtColor(display_frame, cv2.COLOR_GRAY2BGR)
                     cv2.putText(display_frame, f"Hidden QR: {qr_data}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
@@ -146,15 +180,24 @@ def main():
             cv2.imshow('LSB QR Scanner', frame)
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
-                print("Quit key pressed.")
+                log("Quit key pressed.")
                 break
 
+    except KeyboardInterrupt:
+        log("Interrupted.")
     finally:
+        if headless:
+            frame_queue.join()  # Finish the last frame of a file or synthetic source
         stop_event.set()
         worker.join()
+        log(frame_queue.summary())
+        pool.close()
+        if sink:
+            sink.close()
         cap.release()
-        cv2.destroyAllWindows()
-        print("Camera released and windows closed.")
+        if not headless:
+            cv2.destroyAllWindows()
+        log("Camera released and windows closed.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,43 +1,69 @@
+"""
+Usage:
+  static_lsb_qr_extractor.py [--source=<src>] [--headless]
+
+Options:
+  -h, --help                Show this help
+  --source=<src>            Frames to scan: camera index, video file, image directory or glob, or synthetic[:key=value,...] [default: 0]
+  --headless                No window and no per-frame output, only the FPS
+"""
+
 import cv2
+import docopt
 import time
 
+from frame_sources import open_source
+
 def main():
+    args = docopt.docopt(__doc__)
+    headless = args["--headless"]
+
     print("Initializing camera...")
-    cap = cv2.VideoCapture(0)
+    cap = open_source(args["--source"])
     
     if not cap.isOpened():
         print("Error: Could not open camera.")
         return
 
     print("Camera initialized successfully.")
-    print("Camera feed should be visible. Press 'q' to quit.")
+    if headless:
+        print("Reading frames headless. Press Ctrl+C to quit.")
+    else:
+        print("Camera feed should be visible. Press 'q' to quit.")
 
     frame_count = 0
     start_time = time.time()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            break
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                print("Failed to grab frame")
+                break
+
+            frame_count += 1
+            if frame_count % 30 == 0:  # Print every 30 frames
+                elapsed_time = time.time() - start_time
+                fps = frame_count / elapsed_time
+                print(f"FPS: {fps:.2f}")
 
-        frame_count += 1
-        if frame_count % 30 == 0:  # Print every 30 frames
-            elapsed_time = time.time() - start_time
-            fps = frame_count / elapsed_time
-            print(f"FPS: {fps:.2f}")
+            if headless:
+                continue
 
-        cv2.imshow('Camera Feed', frame)
-        print(f"Frame {frame_count} displayed.")  # Debug print
+            cv2.imshow('Camera Feed', frame)
+            print(f"Frame {frame_count} displayed.")  # Debug print
 
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('q'):
-            print("Quit key pressed.")
-            break
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                print("Quit key pressed.")
+                break
+    except KeyboardInterrupt:
+        print("Interrupted.")
 
     print("Releasing camera and closing windows...")
     cap.release()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
     print("Camera released and windows closed.")
 
 if __name__ == "__main__":